@@ -17,7 +17,7 @@ db.init_app(app)
 migrate.init_app(app, db)
 login_manager.init_app(app)
 login_manager.login_view = 'login'
-from app import models, routes  # Import models and routes
+from app import models, routes, commands  # Import models, routes and CLI commands
 
 @app.template_filter('format_time')
 def format_time_filter(time_obj):
@@ -0,0 +1,84 @@
+# attendance.py - the one place attendance rows are written
+from datetime import datetime, timezone
+from sqlalchemy import insert, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Attendance, AttendanceStatus
+from app.class_counters import queue_counter_change
+from app.student_summary import queue_summary_invalidation
+
+def _existing_pairs(rows):
+    """The (class_id, student_id) pairs of rows that already have attendance"""
+    class_ids = {row['class_id'] for row in rows}
+    student_ids = {row['student_id'] for row in rows}
+    return set(db.session.query(Attendance.class_id, Attendance.student_id).filter(
+        Attendance.class_id.in_(class_ids), Attendance.student_id.in_(student_ids)
+    ).all()) & {(row['class_id'], row['student_id']) for row in rows}
+
+def _insert_one_by_one(rows):
+    """Insert rows one savepoint at a time, skipping those another worker got to first"""
+    inserted = set()
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(Attendance).values(row))
+        except IntegrityError:
+            # Only a duplicate pair is expected; a bad foreign key is the caller's bug
+            if not _existing_pairs([row]):
+                raise
+            continue
+        inserted.add((row['class_id'], row['student_id']))
+    return inserted
+
+def _insert_missing(rows):
+    """Insert the rows whose (class_id, student_id) has no attendance yet, returning the pairs inserted
+
+    The unique constraint on the pair makes this safe against other workers
+    marking the same student at the same time, and only a row this call
+    actually wrote is reported. SQLite says which rows it inserted. MySQL
+    can't: with CLIENT_FOUND_ROWS (which SQLAlchemy always sets) a no-op
+    ON DUPLICATE KEY UPDATE counts like an insert and INSERT IGNORE hides
+    foreign key errors. So MySQL and other databases insert row by row,
+    each in a savepoint, and skip the pairs that turn out to exist.
+    """
+    dialect = db.session.get_bind().dialect
+    if dialect.name == 'sqlite':
+        statement = sqlite_insert(Attendance).values(rows).on_conflict_do_nothing(
+            index_elements=['class_id', 'student_id']
+        ).returning(Attendance.class_id, Attendance.student_id)
+        return {(row.class_id, row.student_id) for row in db.session.execute(statement)}
+    return _insert_one_by_one(rows)
+
+def mark_attendance(marks, status=AttendanceStatus.present, overwrite=False, timestamp=None):
+    """Write attendance for a list of (student_id, class_id) marks and return the set of marks that made a new row
+
+    Without overwrite an existing row is left as it is (a scan never undoes a
+    lecturer's mark); with overwrite its status and timestamp are replaced.
+    The caller commits.
+    """
+    marks = list(dict.fromkeys((int(student_id), int(class_id)) for student_id, class_id in marks))
+    if not marks:
+        return set()
+
+    timestamp = timestamp or datetime.now(timezone.utc).astimezone()
+    inserted = _insert_missing([{'student_id': student_id, 'class_id': class_id, 'attendance_status': status,
+                                 'timestamp': timestamp} for student_id, class_id in marks])
+    created = {(student_id, class_id) for student_id, class_id in marks if (class_id, student_id) in inserted}
+
+    existing = [mark for mark in marks if mark not in created]
+    if overwrite and existing:
+        for class_id in {class_id for _, class_id in existing}:
+            db.session.execute(update(Attendance).where(
+                Attendance.class_id == class_id,
+                Attendance.student_id.in_([student_id for student_id, c in existing if c == class_id])
+            ).values(attendance_status=status, timestamp=timestamp))
+
+    # Core statements skip the ORM events that keep the dashboard caches in step
+    for student_id, class_id in created:
+        queue_summary_invalidation(db.session, ('student', student_id))
+        queue_counter_change(db.session, ('attendance', class_id, 1))
+    if overwrite:
+        for student_id, _ in existing:
+            queue_summary_invalidation(db.session, ('student', student_id))
+    return created
@@ -0,0 +1,141 @@
+# class_counters.py - cached enrolled / facial data / attendance counts shown on the scanner page
+import threading
+import time
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from config import Config
+from app.models import Attendance, ClassSession, Enrollment, FacialData
+
+class ClassCounters:
+    """Per-class counters for the attendance scanner, keyed by class_id
+
+    The attendance count is moved up and down as rows are written, so a page
+    load during scanning doesn't go back to the database. Enrollment and facial
+    data changes drop the counters of the affected module (or all of them). The
+    TTL picks up rows written by other worker processes.
+    """
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._entries = {}  # class_id -> (loaded_at, counters)
+        self._class_versions = {}
+        self._module_epochs = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def _token(self, class_session):
+        return self._epoch, self._class_versions.get(class_session.class_id, 0), self._module_epochs.get(class_session.module_id, 0)
+
+    def get_many(self, class_sessions, loader):
+        """Counters for each class session, loading the missing ones together with loader(class_sessions)
+
+        loader returns {class_id: {'enrollment_count', 'facial_data_count', 'attendance_count'}}.
+        """
+        now = time.monotonic()
+        counters, missing = {}, []
+        with self._lock:
+            for stale in [c for c, (loaded_at, _) in self._entries.items() if now - loaded_at >= self.ttl]:
+                del self._entries[stale]
+            for class_session in class_sessions:
+                entry = self._entries.get(class_session.class_id)
+                if entry is not None:
+                    counters[class_session.class_id] = dict(entry[1])
+                else:
+                    missing.append(class_session)
+            tokens = {c.class_id: self._token(c) for c in missing}
+
+        if missing:
+            loaded = loader(missing)
+            with self._lock:
+                for class_session in missing:
+                    values = dict(loaded[class_session.class_id], module_id=class_session.module_id)
+                    counters[class_session.class_id] = dict(values)
+                    # A mark committed while loading may or may not be in the result, so leave it to the next load
+                    if self._token(class_session) == tokens[class_session.class_id]:
+                        self._entries[class_session.class_id] = (now, values)
+        return counters
+
+    def add_attendance(self, class_id, delta):
+        with self._lock:
+            self._class_versions[class_id] = self._class_versions.get(class_id, 0) + 1
+            entry = self._entries.get(class_id)
+            if entry is not None:
+                entry[1]['attendance_count'] = max(entry[1]['attendance_count'] + delta, 0)
+
+    def invalidate_class(self, class_id):
+        with self._lock:
+            self._entries.pop(class_id, None)
+            self._class_versions[class_id] = self._class_versions.get(class_id, 0) + 1
+
+    def invalidate_module(self, module_id):
+        """Drop the counters of every class of module_id"""
+        with self._lock:
+            for class_id in [c for c, (_, counters) in self._entries.items() if counters['module_id'] == module_id]:
+                del self._entries[class_id]
+            self._module_epochs[module_id] = self._module_epochs.get(module_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+
+class_counters = ClassCounters(Config.CLASS_COUNTER_CACHE_TTL)
+
+# Same after-commit pattern as the gallery cache; bulk query.delete() calls must invalidate explicitly
+def queue_counter_change(session, change):
+    """Apply a (kind, key, delta) change once session commits, e.g. ('attendance', class_id, 1)"""
+    session.info.setdefault('counter_changes', []).append(change)
+
+def _queue_change(target, change):
+    session = object_session(target)
+    if session is not None:
+        queue_counter_change(session, change)
+
+@event.listens_for(Attendance, 'after_insert')
+def _attendance_inserted(mapper, connection, target):
+    _queue_change(target, ('attendance', target.class_id, 1))
+
+@event.listens_for(Attendance, 'after_delete')
+def _attendance_deleted(mapper, connection, target):
+    _queue_change(target, ('attendance', target.class_id, -1))
+
+@event.listens_for(Attendance, 'after_update')
+def _attendance_updated(mapper, connection, target):
+    # Status changes keep the row count; only a row moved between classes changes it
+    history = inspect(target).attrs.class_id.history
+    for class_id in list(history.added) + list(history.deleted):
+        _queue_change(target, ('class', class_id, None))
+
+@event.listens_for(Enrollment, 'after_insert')
+@event.listens_for(Enrollment, 'after_update')
+@event.listens_for(Enrollment, 'after_delete')
+def _enrollment_changed(mapper, connection, target):
+    _queue_change(target, ('module', target.module_id, None))
+    for module_id in inspect(target).attrs.module_id.history.deleted:
+        _queue_change(target, ('module', module_id, None))
+
+@event.listens_for(FacialData, 'after_insert')
+@event.listens_for(FacialData, 'after_delete')
+def _facial_data_changed(mapper, connection, target):
+    # A student's faces count in every module they take; uploads are rare enough to just start over
+    _queue_change(target, ('all', None, None))
+
+@event.listens_for(ClassSession, 'after_update')
+@event.listens_for(ClassSession, 'after_delete')
+def _class_session_changed(mapper, connection, target):
+    _queue_change(target, ('class', target.class_id, None))
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    for kind, key, delta in session.info.pop('counter_changes', ()):
+        if kind == 'attendance':
+            class_counters.add_attendance(key, delta)
+        elif kind == 'class':
+            class_counters.invalidate_class(key)
+        elif kind == 'module':
+            class_counters.invalidate_module(key)
+        else:
+            class_counters.clear()
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('counter_changes', None)
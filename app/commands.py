@@ -0,0 +1,241 @@
+import os
+import random
+import re
+import time
+import click
+import numpy as np
+from datetime import date
+from sqlalchemy import inspect as sa_inspect, text as sa_text
+from app import app, db
+from app.models import Attendance, AttendanceStatus, ClassSession, Enrollment, FacialData
+from config import Config
+from app.facial_recognition import EMBEDDING_VERSION, build_face_index, deserialize_embedding, load_face_embedding, store_face_embedding, store_face_images, write_face_thumbnail
+from app.face_gallery import gallery_cache
+from app.face_import import import_faces
+from app.face_index import face_index
+from app.face_projection import FaceProjection, fit_projection_batches, get_active_projection, latest_projection_path, reset_active_projection
+from app.face_storage import content_hash, face_store, release_face_blobs
+
+@app.cli.command('backfill-embeddings')
+@click.option('--force', is_flag=True, help='Recompute embeddings that are already up to date.')
+@click.option('--batch-size', default=100, show_default=True, help='Rows to commit at a time.')
+def backfill_embeddings(force, batch_size):
+    """Compute and store face embeddings for existing facial data"""
+    query = FacialData.query
+    if not force:
+        query = query.filter(db.or_(FacialData.embedding.is_(None),
+                                    FacialData.embedding_version != EMBEDDING_VERSION))
+    
+    rows = query.all()
+    stored = failed = 0
+    for i, facial_data in enumerate(rows, start=1):
+        if store_face_embedding(facial_data, face_store.local_path(facial_data.image_path)):
+            stored += 1
+        else:
+            failed += 1
+            print(f"Could not compute embedding for student {facial_data.student_id} ({facial_data.image_path})")
+        
+        if i % batch_size == 0:
+            db.session.commit()
+    
+    db.session.commit()
+    print(f"Stored {stored} embedding(s), {failed} failed.")
+
+@app.cli.command('backfill-thumbnails')
+@click.option('--batch-size', default=100, show_default=True, help='Rows to commit at a time.')
+def backfill_thumbnails(batch_size):
+    """Generate roster thumbnails for facial data uploaded before thumbnails existed"""
+    rows = FacialData.query.filter(FacialData.thumbnail_path.is_(None)).all()
+    stored = 0
+    for i, facial_data in enumerate(rows, start=1):
+        if face_store.exists(facial_data.image_path):
+            write_face_thumbnail(facial_data, face_store.read(facial_data.image_path))
+            stored += facial_data.thumbnail_path is not None
+        else:
+            print(f"Missing image for student {facial_data.student_id} ({facial_data.image_path})")
+        
+        if i % batch_size == 0:
+            db.session.commit()
+    
+    db.session.commit()
+    print(f"Generated {stored} thumbnail(s) for {len(rows)} row(s).")
+
+@app.cli.command('migrate-face-storage')
+@click.option('--batch-size', default=100, show_default=True, help='Rows to commit at a time.')
+def migrate_face_storage(batch_size):
+    """Move flat student_<number>.jpg images and thumbnails into content-addressed storage"""
+    rows = [row for row in FacialData.query.all()
+            if content_hash(row.image_path) is None
+            or (row.thumbnail_path and content_hash(row.thumbnail_path) is None)]
+    moved = missing = 0
+    for start in range(0, len(rows), batch_size):
+        replaced = []
+        for facial_data in rows[start:start + batch_size]:
+            if not face_store.exists(facial_data.image_path):
+                missing += 1
+                print(f"Missing image for student {facial_data.student_id} ({facial_data.image_path})")
+                continue
+            replaced.extend(store_face_images(facial_data, face_store.read(facial_data.image_path)))
+            moved += 1
+        
+        # Old files are only removed once the rows pointing at the new keys are committed
+        db.session.commit()
+        release_face_blobs(replaced)
+    
+    print(f"Moved {moved} image(s), {missing} missing.")
+
+@app.cli.command('check-face-index')
+@click.option('--samples', default=200, show_default=True, help='Stored faces to use as queries.')
+@click.option('--noise', default=0.02, show_default=True, help='Gaussian noise added to each query.')
+def check_face_index(samples, noise):
+    """Compare walk-in index results against a brute-force scan"""
+    if not build_face_index():
+        return
+    rows = FacialData.query.filter(FacialData.embedding.isnot(None)).all()
+    embeddings = [e for e in (load_face_embedding(row) for row in rows) if e is not None]
+    if not embeddings:
+        print("No stored embeddings to query.")
+        return
+    
+    rng = np.random.default_rng(0)
+    projection = get_active_projection()
+    queries = [projection.project(e + rng.normal(0, noise, e.shape).astype(np.float32))
+               for e in random.Random(0).sample(embeddings, min(samples, len(embeddings)))]
+    print(f"Index: {len(face_index)} faces, {len(face_index.centroids)} lists, {face_index.n_probe} probed")
+    print(f"Recall@1: {face_index.recall(queries, k=1):.3f}  Recall@5: {face_index.recall(queries, k=5):.3f}")
+
+@app.cli.command('fit-face-projection')
+@click.option('--components', default=Config.FACE_PROJECTION_COMPONENTS, show_default=True, help='Dimensions to keep.')
+@click.option('--dtype', default=Config.FACE_PROJECTION_DTYPE, show_default=True,
+              type=click.Choice(['float16', 'float32']), help='Storage type of projected embeddings.')
+@click.option('--batch-size', default=500, show_default=True, help='Rows to fit on and re-project at a time.')
+def fit_face_projection(components, dtype, batch_size):
+    """Fit a new PCA projection on all enrolled faces and re-project every stored embedding
+    
+    Embeddings are read batch_size rows at a time, for the fit and again for
+    the re-projection, so memory use does not grow with the gallery.
+    """
+    facial_ids = [facial_id for (facial_id,) in db.session.query(FacialData.facial_id).filter(
+        FacialData.embedding.isnot(None), FacialData.embedding_version == EMBEDDING_VERSION
+    ).order_by(FacialData.facial_id)]
+    if len(facial_ids) < 2:
+        print("Need at least two stored embeddings to fit a projection.")
+        return
+    chunks = [facial_ids[start:start + batch_size] for start in range(0, len(facial_ids), batch_size)]
+    
+    latest = latest_projection_path()
+    version = FaceProjection.load(latest).version + 1 if latest else 1
+    
+    def embedding_batches():
+        for chunk in chunks:
+            blobs = db.session.query(FacialData.embedding).filter(
+                FacialData.facial_id.in_(chunk), FacialData.embedding.isnot(None),
+                FacialData.embedding_version == EMBEDDING_VERSION
+            ).all()
+            if blobs:
+                yield np.vstack([deserialize_embedding(blob) for (blob,) in blobs])
+    
+    projection = fit_projection_batches(embedding_batches(), len(facial_ids), n_components=components,
+                                        dtype=dtype, version=version)
+    path = projection.save()
+    print(f"Saved {projection.dim}-dim projection v{version} to {path}")
+    
+    reprojected = 0
+    for chunk in chunks:
+        batch = [row for row in FacialData.query.filter(FacialData.facial_id.in_(chunk)).all()
+                 if load_face_embedding(row) is not None]
+        if batch:
+            projected = projection.project(np.vstack([load_face_embedding(row) for row in batch]))
+            for row, vector in zip(batch, projected):
+                row.projected_embedding = projection.serialize(vector)
+                row.projection_version = version
+        db.session.commit()
+        reprojected += len(batch)
+    
+    reset_active_projection()
+    gallery_cache.clear()
+    print(f"Re-projected {reprojected} embedding(s).")
+
+@app.cli.command('import-faces')
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--report', default=None, help='JSONL report path (default: <source>.report.jsonl).')
+@click.option('--workers', default=None, type=int, help='Threads verifying images (default: CPU count).')
+@click.option('--batch-size', default=100, show_default=True, help='Rows to upsert per commit.')
+def import_faces_command(source, report, workers, batch_size):
+    """Bulk-enroll faces from a zip or directory of <student_number>.jpg files (re-run to resume)"""
+    report = report or source.rstrip(os.sep) + '.report.jsonl'
+    started = time.perf_counter()
+    
+    def progress(processed, pending, summary):
+        print(f"{processed}/{pending} files processed ({time.perf_counter() - started:.0f}s)")
+    
+    summary = import_faces(source, report, workers, batch_size, progress)
+    print(f"Import finished in {time.perf_counter() - started:.1f}s: {summary}")
+    print(f"Per-file report: {report}")
+
+def query_plan_checks(student_id, module_id, class_id, lecturer_id, class_date):
+    """(name, query, table, leading index columns it should be served by) for the hot route queries"""
+    return [
+        ('attendance lookup before marking', Attendance.query.filter_by(student_id=student_id, class_id=class_id),
+         'attendance', ('class_id', 'student_id')),
+        ('students already present in a class', db.session.query(Attendance.student_id).filter(
+            Attendance.class_id == class_id, Attendance.attendance_status == AttendanceStatus.present),
+         'attendance', ('class_id',)),
+        ('module roster', Enrollment.query.filter_by(module_id=module_id), 'enrollments', ('module_id',)),
+        ('enrollment check', Enrollment.query.filter_by(student_id=student_id, module_id=module_id),
+         'enrollments', ('module_id', 'student_id')),
+        ('student facial data', FacialData.query.filter_by(student_id=student_id), 'facial_data', ('student_id',)),
+        ("lecturer's classes for a day", ClassSession.query.filter_by(lecturer_id=lecturer_id, class_date=class_date)
+         .order_by(ClassSession.start_time), 'classes', ('lecturer_id', 'class_date')),
+    ]
+
+def explain_indexes(sql):
+    """{table: index name} the database plans to use for sql"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        used = {}
+        for row in db.session.execute(sa_text(f"EXPLAIN QUERY PLAN {sql}")).fetchall():
+            found = re.search(r'(?:SEARCH|SCAN) (\w+)(?: AS \w+)? USING (?:COVERING )?INDEX (\w+)', row[-1])
+            if found:
+                used[found.group(1)] = found.group(2)
+        return used
+    if dialect == 'mysql':
+        return {row._mapping['table']: row._mapping['key']
+                for row in db.session.execute(sa_text(f"EXPLAIN {sql}")).fetchall() if row._mapping['key']}
+    raise click.ClickException(f"Query plan checks support MySQL and SQLite, not {dialect}")
+
+def index_columns(table, index):
+    if db.engine.dialect.name == 'sqlite':
+        # Unique constraints are backed by sqlite_autoindex_* indexes that reflection doesn't name
+        return tuple(row[2] for row in db.session.execute(sa_text(f"PRAGMA index_info('{index}')")).fetchall())
+    inspector = sa_inspect(db.engine)
+    for entry in inspector.get_indexes(table) + inspector.get_unique_constraints(table):
+        if entry['name'] == index:
+            return tuple(entry['column_names'])
+    return ()
+
+@app.cli.command('check-query-plans')
+def check_query_plans():
+    """Check that the main route queries are planned on the lookup indexes (exits 1 if not)"""
+    sample_class = ClassSession.query.first()
+    sample_enrollment = Enrollment.query.first()
+    checks = query_plan_checks(
+        student_id=sample_enrollment.student_id if sample_enrollment else 1,
+        module_id=sample_enrollment.module_id if sample_enrollment else 1,
+        class_id=sample_class.class_id if sample_class else 1,
+        lecturer_id=sample_class.lecturer_id if sample_class else 1,
+        class_date=sample_class.class_date if sample_class else date.today()
+    )
+    
+    failures = 0
+    for name, query, table, leading in checks:
+        sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        index = explain_indexes(sql).get(table)
+        columns = index_columns(table, index) if index else ()
+        ok = columns[:len(leading)] == leading
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: {table} via {index or 'full scan'} {list(columns) if columns else ''}")
+    
+    if failures:
+        print(f"{failures} query plan(s) not using their index (is the database at the latest migration?)")
+        raise SystemExit(1)
@@ -0,0 +1,63 @@
+# face_detector.py - shared Haar cascade face detection
+import threading
+import time
+import cv2
+
+CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+
+# CascadeClassifier is not thread-safe, so each thread parses the XML once and keeps its own copy
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {
+    'cascade_loads': 0,
+    'cascade_load_seconds': 0.0,
+    'detect_calls': 0,
+    'detect_seconds': 0.0,
+}
+
+def _get_cascade():
+    cascade = getattr(_local, 'cascade', None)
+    if cascade is None:
+        start = time.perf_counter()
+        cascade = cv2.CascadeClassifier(CASCADE_PATH)
+        elapsed = time.perf_counter() - start
+        if cascade.empty():
+            raise RuntimeError(f"Could not load face cascade from {CASCADE_PATH}")
+        
+        with _stats_lock:
+            _stats['cascade_loads'] += 1
+            _stats['cascade_load_seconds'] += elapsed
+        _local.cascade = cascade
+    return cascade
+
+def detect_faces(gray, mode='all', scale_factor=1.3, min_neighbors=5):
+    """Detect faces in a grayscale image and return a list of (x, y, w, h) tuples
+    
+    mode='all' returns every face, 'first' the first detection and 'largest'
+    the face with the biggest area (both at most one rectangle).
+    """
+    if mode not in ('all', 'first', 'largest'):
+        raise ValueError(f"Unknown detection mode: {mode}")
+    
+    cascade = _get_cascade()
+    start = time.perf_counter()
+    faces = cascade.detectMultiScale(gray, scale_factor, min_neighbors)
+    elapsed = time.perf_counter() - start
+    
+    with _stats_lock:
+        _stats['detect_calls'] += 1
+        _stats['detect_seconds'] += elapsed
+    
+    faces = [tuple(int(v) for v in rect) for rect in faces]
+    if not faces or mode == 'all':
+        return faces
+    if mode == 'first':
+        return faces[:1]
+    return [max(faces, key=lambda rect: rect[2] * rect[3])]
+
+def detector_stats():
+    """Cascade load counts and cumulative timings for this process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['avg_detect_ms'] = round(stats['detect_seconds'] / stats['detect_calls'] * 1000, 3) if stats['detect_calls'] else 0.0
+    return stats
@@ -0,0 +1,263 @@
+# face_gallery.py - in-memory per-module galleries of precomputed face embeddings
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from config import Config
+from app.models import Enrollment, FacialData
+
+class ModuleGallery:
+    """The enrolled faces of one module, held by a recognizer backend (see recognizers.py)"""
+    def __init__(self, module_id, roster, backend):
+        self.module_id = module_id
+        self.roster = frozenset(roster)  # every enrolled student, with or without face data
+        self.backend = backend
+        self.built_at = time.monotonic()
+        self.stamp = None  # the module's shared version stamp when it was built (see GalleryCache.get)
+        self.checked_at = self.built_at
+    
+    def __len__(self):
+        return len(self.backend)
+    
+    @property
+    def student_ids(self):
+        return self.backend.student_ids
+    
+    @property
+    def nbytes(self):
+        return self.backend.nbytes
+    
+    @property
+    def key(self):
+        return self.backend.key
+    
+    def all_present(self, present):
+        """True when every student with face data is in present, so no frame can mark anyone new"""
+        if len(self) == 0 or not present:
+            return False
+        return bool(np.isin(self.student_ids, np.fromiter(present, dtype=np.int64)).all())
+    
+    def scores(self, embedding):
+        """Similarity of one raw embedding against every face in the gallery"""
+        if len(self) == 0:
+            return np.empty(0, dtype=np.float32)
+        return self.backend.identify([embedding])[0]
+    
+    def best_match(self, embedding, threshold=None):
+        """Return (student_id, similarity) of the best match above threshold, or (None, best similarity)
+        
+        Every student is scored, including those already marked: leaving them
+        out would hand a rescanned face to the next most similar student.
+        """
+        threshold = self.backend.threshold if threshold is None else threshold
+        scores = self.scores(embedding)
+        if len(scores) == 0:
+            return None, 0.0
+        
+        best = int(np.argmax(scores))
+        similarity = float(scores[best])
+        if similarity > threshold:
+            return int(self.student_ids[best]), similarity
+        return None, similarity
+
+    def match_many(self, embeddings, threshold=None):
+        """Match several faces at once with one-to-one assignment
+        
+        Returns a (student_id or None, similarity) pair per embedding. Faces are
+        scored in one batched identify() call and assigned so that no two faces
+        can claim the same student.
+        """
+        threshold = self.backend.threshold if threshold is None else threshold
+        results = [(None, 0.0)] * len(embeddings)
+        if len(self) == 0 or not embeddings:
+            return results
+        
+        scores = self.backend.identify(np.vstack(embeddings))
+        
+        best = scores.max(axis=1)
+        results = [(None, float(b)) for b in best]
+        rows, cols = linear_sum_assignment(scores, maximize=True)
+        for row, col in zip(rows, cols):
+            similarity = float(scores[row, col])
+            if similarity > threshold:
+                results[row] = (int(self.student_ids[col]), similarity)
+        return results
+
+class GalleryCache:
+    """LRU cache of ModuleGallery objects keyed by module_id, with size and TTL eviction
+    
+    Commits in this process invalidate right away. Commits in other worker
+    processes are caught by comparing a stamp of the module's rows in the
+    database, at most every stamp_interval seconds per gallery.
+    """
+    def __init__(self, max_size=64, ttl=900, stamp_interval=5):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stamp_interval = stamp_interval
+        self._galleries = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks = {}  # module_id -> lock held while that module's gallery is built
+        # Bumped on every invalidation so other processes (the recognition pool) can tell
+        # their copies are stale: a global epoch for student changes, one per module otherwise
+        self._epoch = 0
+        self._module_epochs = {}
+    
+    def _cached(self, module_id):
+        with self._lock:
+            gallery = self._galleries.get(module_id)
+            if gallery is not None and time.monotonic() - gallery.built_at < self.ttl:
+                self._galleries.move_to_end(module_id)
+                return gallery
+            return None
+    
+    def _check_stamp(self, gallery, stamp):
+        """Drop gallery if stamp(module_id) shows another worker changed its module since it was built"""
+        now = time.monotonic()
+        with self._lock:
+            if now - gallery.checked_at < self.stamp_interval:
+                return True
+            gallery.checked_at = now
+        if stamp(gallery.module_id) == gallery.stamp:
+            return True
+        with self._lock:
+            if self._galleries.get(gallery.module_id) is gallery:
+                del self._galleries[gallery.module_id]
+                self._module_epochs[gallery.module_id] = self._module_epochs.get(gallery.module_id, 0) + 1
+        return False
+    
+    def get(self, module_id, builder, stamp=None):
+        """Return the cached gallery for module_id, building it with builder(module_id) if needed
+        
+        stamp(module_id), when given, returns a cheap value that changes whenever
+        the module's roster or faces change in the database.
+        """
+        gallery = self._cached(module_id)
+        if gallery is not None and (stamp is None or self._check_stamp(gallery, stamp)):
+            return gallery
+        
+        # Build outside the cache lock so one slow module doesn't block the others, but only
+        # once per module: a scan arriving during a pre-warm waits for it instead of rebuilding
+        with self._lock:
+            build_lock = self._build_locks.setdefault(module_id, threading.Lock())
+        with build_lock:
+            gallery = self._cached(module_id)
+            if gallery is not None:
+                return gallery
+            # Read the stamp first so a change committed during the build is caught by the next check
+            current = stamp(module_id) if stamp is not None else None
+            gallery = builder(module_id)
+            gallery.stamp = current
+            with self._lock:
+                self._galleries[module_id] = gallery
+                self._galleries.move_to_end(module_id)
+                while len(self._galleries) > self.max_size:
+                    self._galleries.popitem(last=False)
+        return gallery
+    
+    def invalidate(self, module_id):
+        with self._lock:
+            self._galleries.pop(module_id, None)
+            self._module_epochs[module_id] = self._module_epochs.get(module_id, 0) + 1
+    
+    def invalidate_student(self, student_id):
+        """Drop every cached gallery whose roster contains student_id"""
+        with self._lock:
+            for module_id in [m for m, g in self._galleries.items() if student_id in g.roster]:
+                del self._galleries[module_id]
+            self._epoch += 1
+    
+    def clear(self):
+        with self._lock:
+            self._galleries.clear()
+            self._epoch += 1
+    
+    def version(self, module_id):
+        """Token that changes whenever the gallery for module_id may have changed"""
+        with self._lock:
+            return self._epoch, self._module_epochs.get(module_id, 0)
+
+class ClassPresence:
+    """Per-class sets of students already marked present, so scans only score the rest
+    
+    Loaded from the database once per class and then updated by the marking
+    paths. Marks written by other worker processes show up once the TTL
+    expires, so keep it short; a stale set only costs a repeated match or a
+    missed one until the reload.
+    """
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._classes = {}  # class_id -> (loaded_at, set of student_ids)
+        self._lock = threading.Lock()
+    
+    def get(self, class_id, loader):
+        """Students marked present in class_id, loading them with loader(class_id) if needed"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._classes.get(class_id)
+            if entry is not None and now - entry[0] < self.ttl:
+                return frozenset(entry[1])
+            # Drop expired classes so finished sessions don't accumulate
+            for stale in [c for c, (loaded_at, _) in self._classes.items() if now - loaded_at >= self.ttl]:
+                del self._classes[stale]
+        
+        present = set(loader(class_id))
+        with self._lock:
+            self._classes[class_id] = (now, present)
+        return frozenset(present)
+    
+    def mark(self, class_id, student_ids):
+        with self._lock:
+            entry = self._classes.get(class_id)
+            if entry is not None:
+                entry[1].update(student_ids)
+    
+    def unmark(self, class_id, student_ids):
+        with self._lock:
+            entry = self._classes.get(class_id)
+            if entry is not None:
+                entry[1].difference_update(student_ids)
+    
+    def invalidate(self, class_id=None):
+        """Forget one class, or every class when class_id is None"""
+        with self._lock:
+            if class_id is None:
+                self._classes.clear()
+            else:
+                self._classes.pop(class_id, None)
+
+gallery_cache = GalleryCache(Config.GALLERY_CACHE_SIZE, Config.GALLERY_CACHE_TTL, Config.GALLERY_STAMP_INTERVAL)
+class_presence = ClassPresence(Config.PRESENCE_CACHE_TTL)
+
+# Invalidate after commit so a concurrent rebuild can't cache rows that are still uncommitted.
+# Bulk query.delete() calls bypass these events and must invalidate explicitly.
+def _queue_invalidation(target, key):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('gallery_invalidations', set()).add(key)
+
+@event.listens_for(Enrollment, 'after_insert')
+@event.listens_for(Enrollment, 'after_update')
+@event.listens_for(Enrollment, 'after_delete')
+def _enrollment_changed(mapper, connection, target):
+    _queue_invalidation(target, ('module', target.module_id))
+
+@event.listens_for(FacialData, 'after_insert')
+@event.listens_for(FacialData, 'after_update')
+@event.listens_for(FacialData, 'after_delete')
+def _facial_data_changed(mapper, connection, target):
+    _queue_invalidation(target, ('student', target.student_id))
+
+@event.listens_for(Session, 'after_commit')
+def _apply_invalidations(session):
+    for kind, key in session.info.pop('gallery_invalidations', ()):
+        if kind == 'module':
+            gallery_cache.invalidate(key)
+        else:
+            gallery_cache.invalidate_student(key)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidations(session):
+    session.info.pop('gallery_invalidations', None)
@@ -0,0 +1,215 @@
+# face_import.py - bulk face enrollment from a zip or directory of <student_number>.jpg files
+import json
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from config import Config
+from app import db
+from app.models import FacialData, Role, User
+from app.facial_recognition import index_face, ingest_face_image, set_face_embedding, store_face_images
+from app.face_storage import release_face_blobs
+
+BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+IMPORT_ID = re.compile(r'^[0-9a-f]{12}$')
+
+# Report statuses that mean a file needs no further work when an import is resumed
+# ('no_student' is retried, since the student may have been created since)
+DONE_STATUSES = {'imported', 'updated', 'invalid'}
+
+def _is_image(name):
+    return '.' in name and name.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
+
+def list_import_files(source):
+    """Return ([(name, size)], read) for every image in a zip file or directory tree"""
+    if zipfile.is_zipfile(source):
+        archive = zipfile.ZipFile(source)
+        files = [(info.filename, info.file_size) for info in archive.infolist()
+                 if not info.is_dir() and _is_image(info.filename)
+                 and not os.path.basename(info.filename).startswith('.')]
+        return files, archive.read
+
+    files = []
+    for root, _, names in os.walk(source):
+        for name in names:
+            if _is_image(name) and not name.startswith('.'):
+                path = os.path.join(root, name)
+                files.append((os.path.relpath(path, source), os.path.getsize(path)))
+
+    def read(name):
+        with open(os.path.join(source, name), 'rb') as f:
+            return f.read()
+    return sorted(files), read
+
+def load_report(report_path):
+    """Finished entries of an earlier run of the same import, keyed by file name"""
+    done = {}
+    if report_path and os.path.exists(report_path):
+        with open(report_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by the interruption we are resuming from
+                if entry.get('status') in DONE_STATUSES:
+                    done[entry['file']] = entry
+    return done
+
+def import_faces(source, report_path, workers=None, batch_size=100, progress=None):
+    """Verify, embed and store every <student_number>.jpg in source
+
+    Images are ingested in parallel threads (OpenCV releases the GIL), and the
+    FacialData rows of each batch are upserted in one commit. Every file gets
+    a line in the JSONL report at report_path. Files already finished in that
+    report are skipped, so an interrupted import resumes where it stopped.
+    Returns a count per status.
+    """
+    files, read = list_import_files(source)
+    done = load_report(report_path)
+    pending = [(name, size) for name, size in files if done.get(name, {}).get('size') != size]
+    summary = {'total': len(files), 'resumed': len(files) - len(pending)}
+    workers = workers or os.cpu_count() or 1
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, open(report_path, 'a') as report:
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            numbers = {name: os.path.splitext(os.path.basename(name))[0] for name, _ in batch}
+            students = {user.student_number: user.user_id for user in User.query.filter(
+                User.role == Role.student,
+                User.student_number.in_(set(numbers.values()))
+            ).all()}
+            existing = {row.student_id: row for row in FacialData.query.filter(
+                FacialData.student_id.in_(students.values())
+            ).all()} if students else {}
+
+            matched = [(name, size) for name, size in batch if numbers[name] in students]
+            ingested = executor.map(lambda item: ingest_face_image(read(item[0])), matched)
+            results = dict(zip((name for name, _ in matched), ingested))
+
+            entries, touched, replaced, written = [], [], [], []
+            now = datetime.now(timezone.utc).astimezone()
+            for name, size in batch:
+                number = numbers[name]
+                entry = {'file': name, 'size': size, 'student_number': number}
+                if number not in students:
+                    entry.update(status='no_student', message='No student with this student number')
+                else:
+                    face_jpeg, embeddings, error = results[name]
+                    if error:
+                        entry.update(status='invalid', message=error)
+                    else:
+                        student_id = students[number]
+                        facial_data = existing.get(student_id)
+                        entry['status'] = 'updated' if facial_data else 'imported'
+                        if facial_data is None:
+                            facial_data = FacialData(student_id=student_id)
+                            db.session.add(facial_data)
+                            existing[student_id] = facial_data
+                        replaced.extend(store_face_images(facial_data, face_jpeg))
+                        written.extend((facial_data.image_path, facial_data.thumbnail_path))
+                        facial_data.uploaded_at = now
+                        set_face_embedding(facial_data, embeddings)
+                        touched.append(facial_data)
+                entries.append(entry)
+
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                # The blobs were stored before the commit; drop those no committed row points at
+                release_face_blobs(written)
+                for entry in entries:
+                    if entry['status'] in ('imported', 'updated'):
+                        entry.update(status='error', message=str(e))
+            else:
+                release_face_blobs(replaced)
+                for facial_data in touched:
+                    index_face(facial_data)
+
+            # Only written after the commit, so a resumed run never skips an uncommitted row
+            for entry in entries:
+                report.write(json.dumps(entry) + '\n')
+                summary[entry['status']] = summary.get(entry['status'], 0) + 1
+            report.flush()
+            if progress:
+                progress(start + len(batch), len(pending), summary)
+
+    return summary
+
+class ImportRegistry:
+    """Bulk imports started from the admin pages, each running on its own thread
+
+    The state of each import is saved to <import_id>.status.json in folder
+    after every batch, so any web worker can report it. An import whose worker
+    process has gone away shows as interrupted; starting the same source again
+    resumes it from its report.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+
+    def _path(self, import_id):
+        return os.path.join(self.folder, f'{import_id}.status.json')
+
+    def _save(self, state):
+        # Write then rename, so a status request never reads half a file
+        os.makedirs(self.folder, exist_ok=True)
+        temporary = self._path(state['import_id']) + f'.{os.getpid()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+        os.replace(temporary, self._path(state['import_id']))
+
+    def start(self, source, report_path, workers=None, batch_size=100):
+        from app import app
+        import_id = uuid.uuid4().hex[:12]
+        state = {'import_id': import_id, 'source': source, 'report': report_path, 'status': 'running',
+                 'processed': 0, 'pending': None, 'summary': {}, 'started_at': time.time(),
+                 'host': socket.gethostname(), 'pid': os.getpid()}
+
+        def progress(processed, pending, summary):
+            state.update(processed=processed, pending=pending, summary=dict(summary))
+            self._save(state)
+
+        def run():
+            with app.app_context():
+                try:
+                    state['summary'] = import_faces(source, report_path, workers, batch_size, progress)
+                    state['status'] = 'done'
+                except Exception as e:
+                    print(f"Face import {import_id} failed: {str(e)}")
+                    state.update(status='failed', error=str(e))
+                finally:
+                    state['finished_at'] = time.time()
+                    self._save(state)
+                    db.session.remove()
+
+        self._save(state)
+        threading.Thread(target=run, name=f'face-import-{import_id}', daemon=True).start()
+        return dict(state)
+
+    def get(self, import_id):
+        if not IMPORT_ID.match(import_id):
+            return None
+        try:
+            with open(self._path(import_id)) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        if state['status'] == 'running' and state['host'] == socket.gethostname() and not _process_alive(state['pid']):
+            state.update(status='interrupted', error='The worker running this import stopped; start it again to resume')
+        return state
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+face_imports = ImportRegistry(os.path.join(BASE_DIR, Config.FACE_IMPORT_FOLDER))
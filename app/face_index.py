@@ -0,0 +1,185 @@
+# face_index.py - approximate nearest-neighbour index over every stored face embedding
+import threading
+import time
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from config import Config
+
+def _normalize(embedding):
+    embedding = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm else embedding
+
+class FaceIndex:
+    """Inverted-file (IVF) index: KMeans centroids partition the embeddings into lists,
+    and a search only scores the n_probe lists whose centroids are closest to the query.
+    
+    Supports incremental add/remove. search_exact scans everything and is the
+    reference used to measure recall.
+    """
+    def __init__(self, n_lists=0, n_probe=8):
+        self.n_lists = n_lists  # 0 picks ~sqrt(N) at build time
+        self.n_probe = n_probe
+        self.centroids = None
+        self.trained_size = 0
+        self.built_at = None
+        self.projection_version = None  # projection the stored vectors were reduced with
+        self.stamp = None       # database stamp the lists were last built or synced against
+        self.checked_at = None  # when the stamp was last compared (see sync_face_index)
+        self._vectors = {}      # student_id -> normalized embedding
+        self._assignment = {}   # student_id -> list number
+        self._lists = {}        # list number -> set of student_ids
+        self._list_cache = {}   # list number -> (ids array, matrix), rebuilt lazily after changes
+        self._pending = None    # (student_id, vector or None for a removal) made during a rebuild
+        self._pending_version = None
+        self._lock = threading.RLock()
+    
+    def __len__(self):
+        return len(self._vectors)
+    
+    def start_rebuild(self, projection_version):
+        """Record add/remove calls from now on, so a build() over vectors loaded after this keeps them"""
+        with self._lock:
+            self._pending = []
+            self._pending_version = projection_version
+    
+    def build(self, student_ids, embeddings, projection_version=None, stamp=None):
+        """Train the centroids on the given embeddings and swap in the new lists
+        
+        Training runs outside the lock, so searches keep using the current lists
+        until the new ones are ready. Changes recorded since start_rebuild are
+        replayed onto the new lists. stamp is the database stamp read before
+        the embeddings were loaded.
+        """
+        vectors = {int(sid): _normalize(e) for sid, e in zip(student_ids, embeddings)}
+        centroids, labels = None, []
+        if vectors:
+            matrix = np.vstack(list(vectors.values()))
+            n_lists = self.n_lists or int(np.sqrt(len(matrix)))
+            n_lists = max(1, min(n_lists, len(matrix)))
+            kmeans = MiniBatchKMeans(n_clusters=n_lists, n_init=1, random_state=0,
+                                     batch_size=min(1024, len(matrix)))
+            labels = kmeans.fit_predict(matrix)
+            centroids = kmeans.cluster_centers_.astype(np.float32)
+        
+        with self._lock:
+            self._vectors = vectors
+            self._assignment = {}
+            self._lists = {}
+            self._list_cache = {}
+            self.centroids = centroids
+            self.trained_size = len(vectors)
+            self.built_at = time.monotonic()
+            self.projection_version = projection_version
+            self.stamp = stamp
+            self.checked_at = self.built_at
+            for student_id, label in zip(vectors, labels):
+                self._assign(student_id, int(label))
+            
+            pending = self._pending if self._pending_version == projection_version else []
+            for student_id, vector in pending or ():
+                if vector is None:
+                    self._remove(student_id)
+                else:
+                    self._add(student_id, vector)
+            self._pending = None
+    
+    def _assign(self, student_id, list_no):
+        self._assignment[student_id] = list_no
+        self._lists.setdefault(list_no, set()).add(student_id)
+        self._list_cache.pop(list_no, None)
+    
+    def add(self, student_id, embedding, projection_version=None):
+        """Insert or replace one student's embedding, reduced with projection_version
+        
+        Ignored unless it matches the built lists or the rebuild in progress.
+        """
+        with self._lock:
+            vector = _normalize(embedding)
+            if self._pending is not None and self._pending_version == projection_version:
+                self._pending.append((student_id, vector))
+            if self.built_at is not None and self.projection_version == projection_version:
+                self._add(student_id, vector)
+    
+    def student_ids(self):
+        with self._lock:
+            return set(self._vectors)
+    
+    def remove(self, student_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((student_id, None))
+            self._remove(student_id)
+    
+    def _add(self, student_id, vector):
+        self._remove(student_id)
+        self._vectors[student_id] = vector
+        if self.centroids is None:
+            self.centroids = vector[np.newaxis, :].copy()
+        self._assign(student_id, int(np.argmax(self.centroids @ vector)))
+    
+    def _remove(self, student_id):
+        self._vectors.pop(student_id, None)
+        list_no = self._assignment.pop(student_id, None)
+        if list_no is not None:
+            self._lists[list_no].discard(student_id)
+            self._list_cache.pop(list_no, None)
+    
+    def _list_matrix(self, list_no):
+        cached = self._list_cache.get(list_no)
+        if cached is None:
+            ids = np.fromiter(self._lists.get(list_no, ()), dtype=np.int64)
+            matrix = np.vstack([self._vectors[i] for i in ids]) if len(ids) else None
+            cached = self._list_cache[list_no] = (ids, matrix)
+        return cached
+    
+    @staticmethod
+    def _top_k(ids, scores, k):
+        order = np.argsort(-scores)[:k]
+        return [(int(ids[i]), float(scores[i])) for i in order]
+    
+    def search(self, embedding, k=1):
+        """Approximate top-k (student_id, similarity) pairs"""
+        with self._lock:
+            if not self._vectors:
+                return []
+            query = _normalize(embedding)
+            probes = np.argsort(-(self.centroids @ query))[:self.n_probe]
+            
+            all_ids = []
+            all_scores = []
+            for list_no in probes:
+                ids, matrix = self._list_matrix(int(list_no))
+                if matrix is not None:
+                    all_ids.append(ids)
+                    all_scores.append(matrix @ query)
+            
+            if not all_ids:
+                return []
+            return self._top_k(np.concatenate(all_ids), np.concatenate(all_scores), k)
+    
+    def search_exact(self, embedding, k=1):
+        """Brute-force top-k over every embedding, for checking recall"""
+        with self._lock:
+            if not self._vectors:
+                return []
+            ids = np.fromiter(self._vectors.keys(), dtype=np.int64)
+            matrix = np.vstack(list(self._vectors.values()))
+            return self._top_k(ids, matrix @ _normalize(embedding), k)
+    
+    def recall(self, queries, k=1):
+        """Fraction of exact top-k results that the approximate search also returns"""
+        found = total = 0
+        for query in queries:
+            exact = {sid for sid, _ in self.search_exact(query, k)}
+            approx = {sid for sid, _ in self.search(query, k)}
+            found += len(exact & approx)
+            total += len(exact)
+        return found / total if total else 1.0
+    
+    @property
+    def needs_rebuild(self):
+        # Lists drift out of balance as students are added after training
+        return self.centroids is None or len(self) > 2 * max(self.trained_size, 1)
+
+face_index = FaceIndex(Config.FACE_INDEX_LISTS, Config.FACE_INDEX_PROBES)
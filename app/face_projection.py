@@ -0,0 +1,114 @@
+# face_projection.py - PCA (eigenface) projection of raw face embeddings to compact vectors
+import glob
+import os
+import re
+import threading
+import time
+import numpy as np
+from sklearn.decomposition import PCA, IncrementalPCA
+from config import Config
+
+BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+MODEL_FOLDER = os.path.join(BASE_DIR, Config.FACE_MODEL_FOLDER)
+
+class FaceProjection:
+    """A fitted PCA projection: (embedding - mean) @ components.T"""
+    def __init__(self, version, mean, components, dtype='float32'):
+        self.version = version
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+        self.dtype = np.dtype(dtype)  # storage dtype of projected vectors
+    
+    @property
+    def dim(self):
+        return self.components.shape[0]
+    
+    def project(self, embeddings):
+        """Project one embedding or a (n, 10000) batch; always returns float32"""
+        return (np.asarray(embeddings, dtype=np.float32) - self.mean) @ self.components.T
+    
+    def serialize(self, projected):
+        return np.asarray(projected, dtype=self.dtype).tobytes()
+    
+    def deserialize(self, blob):
+        return np.frombuffer(blob, dtype=self.dtype).astype(np.float32)
+    
+    def save(self, folder=MODEL_FOLDER):
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"face_projection_v{self.version}.npz")
+        tmp_path = os.path.join(folder, f".tmp_face_projection_v{self.version}.npz")
+        np.savez(tmp_path, mean=self.mean, components=self.components, dtype=str(self.dtype))
+        os.replace(tmp_path, path)  # workers never see a half-written model
+        return path
+    
+    @classmethod
+    def load(cls, path):
+        version = int(re.search(r'_v(\d+)\.npz$', path).group(1))
+        with np.load(path) as data:
+            return cls(version, data['mean'], data['components'], str(data['dtype']))
+
+def fit_projection(embeddings, n_components=128, dtype='float16', version=1):
+    """Fit a PCA projection on a (n, 10000) matrix of raw embeddings"""
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    n_components = min(n_components, matrix.shape[0], matrix.shape[1])
+    pca = PCA(n_components=n_components, svd_solver='randomized', random_state=0)
+    pca.fit(matrix)
+    return FaceProjection(version, pca.mean_, pca.components_, dtype)
+
+def fit_projection_batches(batches, n_samples, n_components=128, dtype='float16', version=1):
+    """Fit a PCA projection on raw embeddings streamed as (k, 10000) batches of n_samples rows in all
+    
+    Uses IncrementalPCA, so only about two batches are in memory at once.
+    partial_fit needs at least n_components rows per call, so small batches are
+    buffered and the last one is fitted together with whatever is left over.
+    """
+    pca = pending = None
+    buffered = []
+    for batch in batches:
+        batch = np.asarray(batch, dtype=np.float32)
+        if pca is None:
+            n_components = min(n_components, n_samples, batch.shape[1])
+            pca = IncrementalPCA(n_components=n_components)
+        buffered.append(batch)
+        if sum(len(b) for b in buffered) >= n_components:
+            if pending is not None:
+                pca.partial_fit(pending)
+            pending = np.vstack(buffered)
+            buffered = []
+    if pca is None:
+        raise ValueError("No embeddings to fit a projection on")
+    pca.partial_fit(np.vstack(([pending] if pending is not None else []) + buffered))
+    return FaceProjection(version, pca.mean_, pca.components_, dtype)
+
+def latest_projection_path(folder=MODEL_FOLDER):
+    paths = glob.glob(os.path.join(folder, 'face_projection_v*.npz'))
+    if not paths:
+        return None
+    return max(paths, key=lambda p: int(re.search(r'_v(\d+)\.npz$', p).group(1)))
+
+_active = None
+_checked_at = 0.0
+_active_lock = threading.Lock()
+
+def get_active_projection(max_age=60):
+    """Newest saved projection, or None before one has been fitted
+    
+    The model folder is re-checked at most every max_age seconds so every
+    process picks up a refit without a restart.
+    """
+    global _active, _checked_at
+    with _active_lock:
+        if time.monotonic() - _checked_at >= max_age:
+            _checked_at = time.monotonic()
+            path = latest_projection_path()
+            if path is None:
+                _active = None
+            elif _active is None or not path.endswith(f"_v{_active.version}.npz"):
+                _active = FaceProjection.load(path)
+        return _active
+
+def reset_active_projection():
+    """Force the next get_active_projection call to look at disk again"""
+    global _checked_at
+    with _active_lock:
+        _checked_at = 0.0
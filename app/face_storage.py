@@ -0,0 +1,160 @@
+# face_storage.py - content-addressed face image blobs in sharded directories
+import hashlib
+from abc import ABC, abstractmethod
+import os
+import threading
+from config import Config
+
+BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+
+def content_hash(key):
+    """SHA-256 a content-addressed key was named after, None for legacy flat keys"""
+    digest = os.path.splitext(os.path.basename(key or ''))[0]
+    if len(digest) == 64 and all(c in '0123456789abcdef' for c in digest):
+        return digest
+    return None
+
+class FaceStore(ABC):
+    """Immutable blobs keyed by their content: the same bytes always get the same key
+
+    FacialData.image_path and thumbnail_path hold these keys. A blob is never
+    rewritten in place, so a key is safe to cache forever; replacing an image
+    means storing a new blob and deleting the old key once nothing refers to it.
+    """
+    def __init__(self, shard_depth=2):
+        self.shard_depth = shard_depth
+
+    def key_for(self, data, ext='jpg'):
+        digest = hashlib.sha256(data).hexdigest()
+        shards = [digest[i * 2:i * 2 + 2] for i in range(self.shard_depth)]
+        return '/'.join(shards + [f"{digest}.{ext}"])
+
+    @abstractmethod
+    def put(self, data, ext='jpg'):
+        """Store data and return its key; storing the same bytes again is a no-op"""
+
+    @abstractmethod
+    def read(self, key):
+        pass
+
+    @abstractmethod
+    def exists(self, key):
+        pass
+
+    @abstractmethod
+    def delete(self, key):
+        pass
+
+    def local_path(self, key):
+        """Filesystem path of a blob, or None if this store has no files to hand out"""
+        return None
+
+class LocalFaceStore(FaceStore):
+    """Blobs as files under root/<aa>/<bb>/<sha256>.<ext>, written via temp file and rename
+
+    Keys that predate content addressing (student_<number>.jpg, thumbs/...) are
+    still read and deleted relative to root.
+    """
+    def __init__(self, root, shard_depth=2):
+        super().__init__(shard_depth)
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def local_path(self, key):
+        path = os.path.realpath(os.path.join(self.root, key))
+        if os.path.commonpath([path, os.path.realpath(self.root)]) != os.path.realpath(self.root):
+            raise ValueError(f"Face storage key outside the store: {key}")
+        return path
+
+    def put(self, data, ext='jpg'):
+        key = self.key_for(data, ext)
+        path = self.local_path(key)
+        if os.path.exists(path):
+            return key
+
+        # Rename is atomic, so readers see either no file or the whole one
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(path),
+                                f".tmp_{os.getpid()}_{threading.get_ident()}_{os.path.basename(path)}")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return key
+
+    def read(self, key):
+        with open(self.local_path(key), 'rb') as f:
+            return f.read()
+
+    def exists(self, key):
+        return os.path.exists(self.local_path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+class MemoryFaceStore(FaceStore):
+    """Blobs in a dict, standing in for an object store in benchmarks and tests"""
+    def __init__(self, shard_depth=2):
+        super().__init__(shard_depth)
+        self._blobs = {}
+        self._lock = threading.Lock()
+
+    def put(self, data, ext='jpg'):
+        key = self.key_for(data, ext)
+        with self._lock:
+            self._blobs.setdefault(key, bytes(data))
+        return key
+
+    def read(self, key):
+        with self._lock:
+            if key not in self._blobs:
+                raise FileNotFoundError(key)
+            return self._blobs[key]
+
+    def exists(self, key):
+        with self._lock:
+            return key in self._blobs
+
+    def delete(self, key):
+        with self._lock:
+            self._blobs.pop(key, None)
+
+def create_face_store(name=None):
+    """Build the store named by Config.FACE_STORAGE_BACKEND ('local' or 'memory')"""
+    name = name or Config.FACE_STORAGE_BACKEND
+    if name == 'local':
+        return LocalFaceStore(os.path.join(BASE_DIR, Config.UPLOAD_FOLDER), Config.FACE_STORAGE_SHARD_DEPTH)
+    if name == 'memory':
+        return MemoryFaceStore(Config.FACE_STORAGE_SHARD_DEPTH)
+    raise ValueError(f"Unknown face storage backend: {name}")
+
+def release_face_blobs(keys):
+    """Delete the blobs among keys that no FacialData row points at any more
+
+    Call after the commit that replaced or removed them, so a rolled-back
+    change never loses the image it would have kept. Returns the number deleted.
+    """
+    from app import db
+    from app.image_cache import face_image_cache
+    from app.models import FacialData
+
+    keys = {key for key in keys if key}
+    if not keys:
+        return 0
+
+    # Identical images share a blob, so another student may still use it
+    referenced = set()
+    for image_path, thumbnail_path in db.session.query(FacialData.image_path, FacialData.thumbnail_path).filter(
+        db.or_(FacialData.image_path.in_(keys), FacialData.thumbnail_path.in_(keys))
+    ).all():
+        referenced.update((image_path, thumbnail_path))
+
+    released = keys - referenced
+    for key in released:
+        face_store.delete(key)
+        face_image_cache.discard(key)
+    return len(released)
+
+face_store = create_face_store()
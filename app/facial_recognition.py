@@ -1,13 +1,25 @@
 # facial_recognition.py - FIXED
 import cv2
-import os
 from config import Config
 import numpy as np
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
+import threading
+import time
 from app.models import Attendance, AttendanceStatus, ClassSession, Enrollment, FacialData, User
 from app import db
+from app.attendance import mark_attendance
+from app.face_detector import detect_faces
+from app.face_gallery import ModuleGallery, class_presence, gallery_cache
+from app.face_index import face_index
+from app.face_storage import face_store
+from app.face_projection import get_active_projection
+from app.recognition_metrics import NO_TIMINGS, StageTimings, recognition_metrics
+from app.recognizers import backend_key, create_backend
+from app.recognition_pool import RecognitionBusy, RecognitionTimeout, run_recognition, warm_workers
+from app.scan_sessions import scan_sessions
 import base64
 import json
+from flask import current_app, g, has_request_context
 
 class NumpyEncoder(json.JSONEncoder):
     """Custom JSON encoder for NumPy data types"""
@@ -18,27 +30,6 @@ class NumpyEncoder(json.JSONEncoder):
             return obj.tolist()
         return super().default(obj)
 
-def verify_face(image_path, student_number, upload_folder):
-    """Verify if the uploaded image contains a clear face"""
-    try:
-        image = cv2.imread(image_path)
-        if image is None:
-            return False, "Invalid image file"
-        
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-        
-        if len(faces) == 0:
-            return False, "No face detected in the image"
-        elif len(faces) > 1:
-            return False, "Multiple faces detected. Please upload an image with only one face"
-        else:
-            return True, "Face verified successfully"
-            
-    except Exception as e:
-        return False, f"Error processing image: {str(e)}"
-
 def extract_face_embeddings(image_path):
     """Extract face embeddings using OpenCV's face recognizer"""
     try:
@@ -51,26 +42,92 @@ def extract_face_embeddings(image_path):
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         
         # Detect face
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.3, 5)
+        faces = detect_faces(gray, mode='first')
         
         if len(faces) == 0:
             return None
         
-        # Extract face region and resize to standard size
-        x, y, w, h = faces[0]
-        face_roi = gray[y:y+h, x:x+w]
-        face_roi = cv2.resize(face_roi, (100, 100))
+        # Extract face region, resize to standard size, normalize and flatten
+        return _face_embedding(gray, faces[0])
         
-        # Normalize and flatten
-        face_roi = face_roi.astype(np.float32) / 255.0
-        embeddings = face_roi.flatten()
+    except Exception as e:
+        print(f"Error extracting embeddings: {e}")
+        return None
+
+def ingest_face_image(image_bytes):
+    """Single pass over an uploaded image: decode from memory, detect once, crop and embed
+    
+    Returns (jpeg_bytes, embeddings, error). Nothing is written to disk, so a
+    bad upload is rejected before anything is stored; jpeg_bytes is the
+    normalized, size-capped face crop to store.
+    """
+    try:
+        image = decode_image_data(image_bytes)
+        if image is None:
+            return None, None, "Invalid image file"
         
-        return embeddings
+        # Shrink large photos before detection; the stored crop is capped again below
+        scale = Config.FACE_INGEST_MAX_SIDE / max(image.shape[:2])
+        if scale < 1:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        faces = detect_faces(gray, mode='all')
+        if len(faces) == 0:
+            return None, None, "No face detected in the image"
+        elif len(faces) > 1:
+            return None, None, "Multiple faces detected. Please upload an image with only one face"
+        
+        embeddings = _face_embedding(gray, faces[0])
+        
+        # Keep a margin around the face so the stored crop still re-detects for backfills
+        x, y, w, h = faces[0]
+        margin = int(max(w, h) * Config.FACE_CROP_MARGIN)
+        crop = image[max(y - margin, 0):y + h + margin, max(x - margin, 0):x + w + margin]
+        scale = Config.FACE_IMAGE_MAX_SIDE / max(crop.shape[:2])
+        if scale < 1:
+            crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        
+        ok, encoded = cv2.imencode('.jpg', crop, [cv2.IMWRITE_JPEG_QUALITY, Config.FACE_JPEG_QUALITY])
+        if not ok:
+            return None, None, "Error encoding face image"
+        return encoded.tobytes(), embeddings, None
         
     except Exception as e:
-        print(f"Error extracting embeddings: {e}")
+        return None, None, f"Error processing image: {str(e)}"
+
+def make_face_thumbnail(face_jpeg):
+    """Square, small JPEG of a stored face crop for roster lists"""
+    image = decode_image_data(face_jpeg)
+    if image is None:
+        return None
+    h, w = image.shape[:2]
+    side = min(h, w)
+    top, left = (h - side) // 2, (w - side) // 2
+    thumb = cv2.resize(image[top:top + side, left:left + side],
+                       (Config.FACE_THUMBNAIL_SIZE, Config.FACE_THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode('.jpg', thumb, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return encoded.tobytes() if ok else None
+
+def write_face_thumbnail(facial_data, face_jpeg):
+    """Generate and store the roster thumbnail for a face crop; returns the key it replaced, if any"""
+    thumbnail = make_face_thumbnail(face_jpeg)
+    if thumbnail is None:
         return None
+    thumbnail_path = face_store.put(thumbnail)
+    old_path, facial_data.thumbnail_path = facial_data.thumbnail_path, thumbnail_path
+    return old_path if old_path != thumbnail_path else None
+
+def store_face_images(facial_data, face_jpeg):
+    """Store a face crop and its thumbnail, returning the keys they replaced
+
+    Pass the returned keys to release_face_blobs once the row is committed.
+    """
+    image_path = face_store.put(face_jpeg)
+    old_path, facial_data.image_path = facial_data.image_path, image_path
+    replaced = [old_path] if old_path and old_path != image_path else []
+    replaced.append(write_face_thumbnail(facial_data, face_jpeg))
+    return [key for key in replaced if key]
 
 def compare_faces(embedding1, embedding2, threshold=0.6):
     """Compare two face embeddings using cosine similarity"""
@@ -88,77 +145,625 @@ def compare_faces(embedding1, embedding2, threshold=0.6):
     similarity = dot_product / (norm1 * norm2)
     return float(similarity)  # Convert to native Python float
 
-def recognize_face_from_image(image_data, class_id):
-    """Recognize face from image data and mark attendance for specific class session"""
+# Bump whenever extract_face_embeddings changes so stale stored vectors get recomputed
+EMBEDDING_VERSION = 1
+
+def serialize_embedding(embeddings):
+    """Pack a face embedding into bytes for the FacialData.embedding column"""
+    return np.asarray(embeddings, dtype=np.float32).tobytes()
+
+def deserialize_embedding(blob):
+    """Unpack a stored face embedding"""
+    return np.frombuffer(blob, dtype=np.float32)
+
+def store_face_embedding(facial_data, image_path):
+    """Compute the embedding for a stored image once and keep it on the FacialData row"""
+    return set_face_embedding(facial_data, extract_face_embeddings(image_path))
+
+def set_face_embedding(facial_data, embeddings):
+    """Keep an already computed embedding (and its projection) on the FacialData row"""
+    if embeddings is None:
+        facial_data.embedding = None
+        facial_data.embedding_version = None
+        store_projected_embedding(facial_data, None)
+        return False
+    
+    facial_data.embedding = serialize_embedding(embeddings)
+    facial_data.embedding_version = EMBEDDING_VERSION
+    store_projected_embedding(facial_data, embeddings)
+    return True
+
+def store_projected_embedding(facial_data, embeddings, projection=None):
+    """Keep the PCA-reduced copy of an embedding in step with the active projection"""
+    projection = projection or get_active_projection()
+    if projection is None or embeddings is None:
+        facial_data.projected_embedding = None
+        facial_data.projection_version = None
+        return
+    
+    facial_data.projected_embedding = projection.serialize(projection.project(embeddings))
+    facial_data.projection_version = projection.version
+
+def load_face_embedding(facial_data):
+    """Return the precomputed embedding for a FacialData row, or None if missing or stale"""
+    if facial_data.embedding is None or facial_data.embedding_version != EMBEDDING_VERSION:
+        return None
+    return deserialize_embedding(facial_data.embedding)
+
+def load_face_vector(facial_data, projection=None):
+    """Vector used for matching: the projected embedding when a projection is active, else the raw one"""
+    if projection is not None and facial_data.projection_version == projection.version:
+        return projection.deserialize(facial_data.projected_embedding)
+    
+    embedding = load_face_embedding(facial_data)
+    if embedding is None or projection is None:
+        return embedding
+    return projection.project(embedding)
+
+def load_face_vectors(*criteria, projection=None):
+    """Return (student_ids, vectors) for the FacialData rows matching criteria
+    
+    With a projection, reads only the compact projected column when it is
+    current; rows not yet re-projected fall back to projecting their raw
+    embedding on the fly. Without one, returns the raw embeddings.
+    """
+    student_ids = []
+    vectors = []
+    
+    if projection is not None:
+        rows = db.session.query(FacialData.student_id, FacialData.projected_embedding).filter(
+            *criteria, FacialData.projection_version == projection.version
+        ).all()
+        for row in rows:
+            student_ids.append(row.student_id)
+            vectors.append(projection.deserialize(row.projected_embedding))
+        stale = db.or_(FacialData.projection_version.is_(None), FacialData.projection_version != projection.version)
+    else:
+        stale = db.true()
+    
+    rows = db.session.query(FacialData.student_id, FacialData.embedding).filter(
+        *criteria, stale,
+        FacialData.embedding.isnot(None),
+        FacialData.embedding_version == EMBEDDING_VERSION
+    ).all()
+    if rows and projection is not None:
+        print(f"Projecting {len(rows)} embeddings on the fly, run 'flask fit-face-projection' to re-project")
+    for row in rows:
+        embedding = deserialize_embedding(row.embedding)
+        student_ids.append(row.student_id)
+        vectors.append(projection.project(embedding) if projection is not None else embedding)
+    
+    return student_ids, vectors
+
+def build_module_gallery(module_id):
+    """Enroll the stored embeddings of every student in a module into the configured recognizer"""
+    enrolled = db.select(Enrollment.student_id).where(Enrollment.module_id == module_id)
+    roster = set(db.session.execute(enrolled).scalars())
+    
+    backend = create_backend(projection=get_active_projection())
+    student_ids, vectors = load_face_vectors(FacialData.student_id.in_(enrolled), projection=backend.projection)
+    if student_ids:
+        # Projected vectors are already in the backend's stored form; raw ones may need converting
+        backend.enroll(student_ids, vectors if backend.projection is not None else backend.prepare(np.vstack(vectors)))
+    return ModuleGallery(module_id, roster, backend)
+
+def gallery_stamp(module_id):
+    """A value that changes whenever any worker changes the enrollments or faces of a module
+    
+    New and deleted rows move the counts and highest ids, a replaced profile
+    image moves uploaded_at and a backfill moves the count of current embeddings.
+    """
+    enrolled = db.select(Enrollment.student_id).where(Enrollment.module_id == module_id)
+    enrollments = db.session.query(db.func.count(Enrollment.enrollment_id), db.func.max(Enrollment.enrollment_id)).filter(
+        Enrollment.module_id == module_id
+    ).one()
+    faces = db.session.query(
+        db.func.count(FacialData.facial_id), db.func.max(FacialData.facial_id), db.func.max(FacialData.uploaded_at),
+        db.func.count(db.case((FacialData.embedding_version == EMBEDDING_VERSION, 1)))
+    ).filter(FacialData.student_id.in_(enrolled)).one()
+    return tuple(enrollments) + tuple(faces)
+
+def get_module_gallery(module_id):
+    """Return the cached gallery for a module, building it on first use"""
+    gallery = gallery_cache.get(module_id, build_module_gallery, gallery_stamp)
+    
+    # A refitted projection or a different backend makes the cached gallery unusable
+    if gallery.key != backend_key(projection=get_active_projection()):
+        gallery_cache.invalidate(module_id)
+        gallery = gallery_cache.get(module_id, build_module_gallery, gallery_stamp)
+    return gallery
+
+def warm_gallery(image_data, module_id):
+    """Pool job that only builds the worker's gallery for module_id (image_data is unused)"""
+    return len(get_module_gallery(module_id))
+
+def _prewarm(module_ids):
+    from app import app
+    with app.app_context():
+        try:
+            if module_ids is None:
+                module_ids = [row.module_id for row in db.session.query(ClassSession.module_id).filter(
+                    ClassSession.class_date == date.today()
+                ).distinct()]
+            # More modules than the cache holds would just evict each other
+            for module_id in module_ids[:Config.GALLERY_CACHE_SIZE]:
+                started = time.perf_counter()
+                gallery = get_module_gallery(module_id)
+                warm_workers(warm_gallery, module_id)
+                print(f"Pre-warmed gallery for module {module_id} ({len(gallery)} faces) in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            print(f"Error pre-warming galleries: {str(e)}")
+        finally:
+            db.session.remove()
+
+def prewarm_galleries(module_ids=None):
+    """Build module galleries on a background thread so the first scan doesn't pay for them
+    
+    With no module_ids, warms every module that has a class scheduled today.
+    """
+    thread = threading.Thread(target=_prewarm, args=(None if module_ids is None else list(module_ids),),
+                              name='gallery-prewarm', daemon=True)
+    thread.start()
+    return thread
+
+_face_index_build_lock = threading.Lock()
+
+def build_face_index():
+    """Train the campus-wide index on every projected embedding; False when no projection is fitted
+    
+    Only the compact projected column is read. Rows not yet re-projected are
+    left out and join through index_face when they are next stored.
+    """
+    projection = get_active_projection()
+    if projection is None:
+        print("No face projection fitted, so there is no campus-wide index (run 'flask fit-face-projection')")
+        return False
+    
+    started = time.perf_counter()
+    face_index.start_rebuild(projection.version)
+    stamp = face_index_stamp(projection)
+    rows = db.session.query(FacialData.student_id, FacialData.projected_embedding).filter(
+        FacialData.projection_version == projection.version
+    ).all()
+    face_index.build([row.student_id for row in rows], [projection.deserialize(row.projected_embedding) for row in rows],
+                     projection.version, stamp)
+    print(f"Built campus-wide face index over {len(face_index)} students in {time.perf_counter() - started:.1f}s")
+    return True
+
+def _build_face_index_in_background():
+    from app import app
+    with app.app_context():
+        try:
+            build_face_index()
+        except Exception as e:
+            print(f"Error building the campus-wide face index: {str(e)}")
+        finally:
+            db.session.remove()
+            _face_index_build_lock.release()
+
+def schedule_face_index_build():
+    """Rebuild the campus-wide index on a background thread unless a build is already running"""
+    if not _face_index_build_lock.acquire(blocking=False):
+        return None
+    thread = threading.Thread(target=_build_face_index_in_background, name='face-index-build', daemon=True)
+    thread.start()
+    return thread
+
+def face_index_stamp(projection):
+    """A value that changes whenever any worker stores, replaces or deletes a face projected with projection"""
+    return tuple(db.session.query(
+        db.func.count(FacialData.facial_id), db.func.max(FacialData.facial_id), db.func.max(FacialData.uploaded_at)
+    ).filter(FacialData.projection_version == projection.version).one())
+
+_face_index_sync_lock = threading.Lock()
+
+def sync_face_index(projection):
+    """Patch the index with faces other workers stored or deleted since it was built or last synced
+    
+    Checks the stamp at most every FACE_INDEX_SYNC_INTERVAL seconds. Faces
+    uploaded since the last stamp, or missing from the index, are added and
+    students without a projected face any more are removed.
+    """
+    now = time.monotonic()
+    if face_index.checked_at is not None and now - face_index.checked_at < Config.FACE_INDEX_SYNC_INTERVAL:
+        return
+    if not _face_index_sync_lock.acquire(blocking=False):
+        return
     try:
-        # Check if class session exists and get detailed info (FROM ATTACHED CODE)
-        class_session = ClassSession.query.get(class_id)
-        if not class_session:
-            return {'success': False, 'message': 'Class not found'}
-        
-        # Detailed class info for debugging (FROM ATTACHED CODE)
-        class_info = f"{class_session.module.module_code} on {class_session.class_date} at {class_session.start_time.strftime('%H:%M')}"
+        face_index.checked_at = now
+        stamp = face_index_stamp(projection)
+        if stamp == face_index.stamp:
+            return
         
-        # Check if class session time has passed (FROM ATTACHED CODE)
-        current_time = datetime.now(timezone.utc).astimezone()
-        class_datetime = datetime.combine(class_session.class_date, class_session.end_time)
-        class_datetime = class_datetime.replace(tzinfo=current_time.tzinfo)
-        
-        if current_time > class_datetime:
-            return {'success': False, 'message': f'Class session {class_info} has ended. Attendance cannot be marked.'}
-        
-        # Decode base64 image
-        header, encoded = image_data.split(",", 1)
-        image_bytes = base64.b64decode(encoded)
-        
-        # Convert to numpy array
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        current_version = FacialData.projection_version == projection.version
+        stored = set(db.session.execute(db.select(FacialData.student_id).where(current_version)).scalars())
+        indexed = face_index.student_ids()
+        missing = stored - indexed
+        if len(missing) > 1000:
+            # Far behind (e.g. a bulk import on another worker): retraining is cheaper than patching
+            schedule_face_index_build()
+            return
         
+        for student_id in indexed - stored:
+            face_index.remove(student_id)
+        changed = FacialData.student_id.in_(missing)
+        if face_index.stamp is not None and face_index.stamp[2] is not None:
+            changed = db.or_(changed, FacialData.uploaded_at >= face_index.stamp[2])
+        for row in db.session.query(FacialData.student_id, FacialData.projected_embedding).filter(current_version, changed):
+            face_index.add(row.student_id, projection.deserialize(row.projected_embedding), projection.version)
+        face_index.stamp = stamp
+    finally:
+        _face_index_sync_lock.release()
+
+def get_face_index():
+    """Return the campus-wide index as it stands, starting a background rebuild when it is unbalanced or re-projected
+    
+    Searches keep using the current lists while the rebuild runs. Uploads and
+    deletions reach this worker's index through index_face and unindex_face,
+    and other workers' through sync_face_index.
+    """
+    projection = get_active_projection()
+    if projection is not None:
+        if face_index.projection_version != projection.version or face_index.needs_rebuild:
+            schedule_face_index_build()
+        else:
+            sync_face_index(projection)
+    return face_index
+
+def index_face(facial_data):
+    """Keep the campus-wide index in step with an uploaded face"""
+    projection = get_active_projection()
+    if projection is None:
+        return
+    vector = load_face_vector(facial_data, projection)
+    if vector is not None:
+        face_index.add(facial_data.student_id, vector, projection.version)
+
+def unindex_face(student_id):
+    face_index.remove(student_id)
+
+def walk_in_threshold(projection):
+    """Similarity a walk-in match must beat: the active backend's threshold
+    
+    The index scores cosine similarity over projected (or raw) embeddings, so
+    LBPH, whose scores are mapped from histogram distances, uses the threshold
+    of the cosine backend for those vectors instead.
+    """
+    backend = create_backend(projection=projection)
+    if backend.name == 'lbph':
+        backend = create_backend('pca', projection)
+    return backend.threshold
+
+def identify_walk_in(image_data, exact=False):
+    """Identify a face against every student and mark them present in their class running now
+    
+    Used in exam halls and open labs where the scanner is not tied to one class.
+    exact=True uses a brute-force scan instead of the index, for checking recall.
+    """
+    timings, stats = StageTimings(), {}
+    result = _identify_walk_in(image_data, exact, timings, stats)
+    record_scan('walk_in', timings, stats)
+    return result
+
+def _identify_walk_in(image_data, exact, timings, stats):
+    try:
+        image = decode_image_data(image_data, timings)
         if image is None:
+            stats['rejection'] = 'invalid_image'
             return {'success': False, 'message': 'Invalid image data'}
         
-        # Extract face embeddings from captured image
-        captured_embeddings = extract_face_embeddings_from_frame(image)
+        captured_embeddings = extract_face_embeddings_from_frame(image, timings)
         if captured_embeddings is None:
+            stats['rejection'] = 'no_face'
             return {'success': False, 'message': 'No face detected in captured image'}
+        stats['faces'] = 1
         
-        # Get enrolled students for this SPECIFIC class session's module (FROM ATTACHED CODE)
-        enrollments = Enrollment.query.filter_by(module_id=class_session.module_id).all()
-        best_match = None
-        best_similarity = 0.0
-        similarity_threshold = 0.6
+        with timings.stage('match'):
+            index = get_face_index()
+            projection = get_active_projection()
+            if projection is None or index.projection_version != projection.version:
+                stats['rejection'] = 'index_unavailable'
+                message = ('Walk-in identification needs a fitted face projection' if projection is None
+                           else 'The walk-in face index is being built, please try again shortly')
+                return {'success': False, 'message': message}
+            captured_embeddings = projection.project(captured_embeddings)
+            results = index.search_exact(captured_embeddings) if exact else index.search(captured_embeddings)
+        stats['gallery_size'] = len(index)
+        if not results or results[0][1] <= walk_in_threshold(projection):
+            stats['rejection'] = 'no_match'
+            return {'success': False, 'message': 'No matching student found. Please ensure facial data is registered.'}
         
-        print(f"Checking {len(enrollments)} enrolled students for class {class_info}")  # FROM ATTACHED CODE
+        student_id, similarity = results[0]
+        with timings.stage('db'):
+            student = User.query.get(student_id)
+        if student is None:
+            unindex_face(student_id)
+            stats['rejection'] = 'no_match'
+            return {'success': False, 'message': 'No matching student found. Please ensure facial data is registered.'}
+        stats['matches'] = 1
         
-        for enrollment in enrollments:
-            student = enrollment.student
-            facial_data = FacialData.query.filter_by(student_id=student.user_id).first()
-            
-            if facial_data:
-                # Get stored face embeddings
-                stored_image_path = os.path.join(Config.UPLOAD_FOLDER, facial_data.image_path)
-                stored_embeddings = extract_face_embeddings(stored_image_path)
-                
-                if stored_embeddings is not None:
-                    similarity = compare_faces(captured_embeddings, stored_embeddings)
-                    
-                    if similarity > best_similarity and similarity > similarity_threshold:
-                        best_similarity = similarity
-                        best_match = student
-                        print(f"Better match found: {student.full_name} ({student.student_number}) - {similarity:.2f}")  # FROM ATTACHED CODE
+        # Check the identified student against their own classes today
+        with timings.stage('db'):
+            todays_classes = ClassSession.query.join(
+                Enrollment, Enrollment.module_id == ClassSession.module_id
+            ).filter(
+                Enrollment.student_id == student_id,
+                ClassSession.class_date == date.today()
+            ).order_by(ClassSession.start_time).all()
+        
+        now = datetime.now().time()
+        active_class = next((c for c in todays_classes if c.start_time <= now <= c.end_time), None)
+        
+        result = {
+            'success': True,
+            'student_name': student.full_name,
+            'student_number': student.student_number,
+            'similarity': round(similarity * 100, 2),
+            'todays_classes': [{
+                'class_id': c.class_id,
+                'module_code': c.module.module_code,
+                'start_time': c.start_time.strftime('%H:%M'),
+                'end_time': c.end_time.strftime('%H:%M'),
+                'location': c.location
+            } for c in todays_classes]
+        }
+        
+        if active_class is None:
+            stats['rejection'] = 'no_active_class'
+            result.update({'already_marked': False, 'class_info': None,
+                           'message': f'{student.full_name} identified but has no class in session right now'})
+            return result
+        
+        class_info = f"{active_class.module.module_code} on {active_class.class_date} at {active_class.start_time.strftime('%H:%M')}"
+        with timings.stage('db'):
+            created = mark_attendance([(student_id, active_class.class_id)])
+            db.session.commit()
+        if not created:
+            stats['rejection'] = 'already_marked'
+        else:
+            record_presence(active_class.class_id, [student_id])
+        
+        verb = 'marked' if created else 'already marked'
+        result.update({'already_marked': not created, 'class_info': class_info,
+                       'message': f'Attendance {verb} for {student.full_name} in {class_info}'})
+        return result
+    
+    except Exception as e:
+        db.session.rollback()
+        stats['rejection'] = 'error'
+        print(f"Error in walk-in face recognition: {str(e)}")
+        return {'success': False, 'message': f'Error in face recognition: {str(e)}'}
+
+def load_scan_class(class_id):
+    """Return (class_session, class_info, error) for a class that can still take attendance"""
+    # Check if class session exists and get detailed info (FROM ATTACHED CODE)
+    class_session = ClassSession.query.get(class_id)
+    if not class_session:
+        return None, None, {'success': False, 'message': 'Class not found'}
+    
+    # Detailed class info for debugging (FROM ATTACHED CODE)
+    class_info = f"{class_session.module.module_code} on {class_session.class_date} at {class_session.start_time.strftime('%H:%M')}"
+    
+    # Check if class session time has passed (FROM ATTACHED CODE)
+    current_time = datetime.now(timezone.utc).astimezone()
+    class_datetime = datetime.combine(class_session.class_date, class_session.end_time)
+    class_datetime = class_datetime.replace(tzinfo=current_time.tzinfo)
+    
+    if current_time > class_datetime:
+        return class_session, class_info, {'success': False, 'message': f'Class session {class_info} has ended. Attendance cannot be marked.'}
+    
+    return class_session, class_info, None
+
+def resolve_scan_class(class_id, scan=None):
+    """Return (module_id, class_info, error), from the bound scan session when there is one"""
+    if scan is not None:
+        return scan.module_id, scan.class_info, scan.ended_error()
+    class_session, class_info, error = load_scan_class(class_id)
+    return (class_session.module_id if class_session else None), class_info, error
+
+def open_scan_session(class_id, lecturer_id, token=None):
+    """Bind a continuous scan session to a class once; returns (scan, error)
+    
+    The gallery is built where frames are matched (the recognition pool
+    workers, or this process without a pool) and the already-present set is
+    loaded here, so the first frame doesn't pay for them. Pass the token to
+    rebind a session issued by another worker.
+    """
+    class_session, class_info, error = load_scan_class(class_id)
+    if error:
+        return None, error
+    if class_session.lecturer_id != lecturer_id:
+        return None, {'success': False, 'message': 'Class not found'}
+    
+    current_time = datetime.now(timezone.utc).astimezone()
+    ends_at = datetime.combine(class_session.class_date, class_session.end_time).replace(tzinfo=current_time.tzinfo)
+    token = token or scan_sessions.issue_token(class_id, lecturer_id)
+    scan = scan_sessions.bind(token, class_session, class_info, ends_at)
+    if Config.RECOGNITION_POOL_SIZE > 0:
+        warm_workers(warm_gallery, class_session.module_id)
+    else:
+        get_module_gallery(class_session.module_id)
+    get_present_students(class_id)
+    return scan, None
+
+def decode_image_data(image_data, timings=NO_TIMINGS):
+    """Decode raw JPEG/PNG bytes or a base64 data URL into a BGR image, or None if invalid"""
+    if isinstance(image_data, str):
+        with timings.stage('base64'):
+            header, encoded = image_data.split(",", 1)
+            image_data = base64.b64decode(encoded)
+    
+    # Wrap the buffer without copying it
+    nparr = np.frombuffer(image_data, np.uint8)
+    if nparr.size == 0:
+        return None
+    with timings.stage('imdecode'):
+        return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+# Messages for match_frame statuses that end a scan before any DB work
+MATCH_ERRORS = {
+    'invalid_image': 'Invalid image data',
+    'no_face': 'No face detected in captured image',
+    'all_marked': 'All enrolled students with facial data are already marked present',
+}
+
+def load_present_students(class_id):
+    return [row.student_id for row in db.session.query(Attendance.student_id).filter(
+        Attendance.class_id == class_id,
+        Attendance.attendance_status == AttendanceStatus.present
+    ).all()]
+
+def get_present_students(class_id):
+    """Students already marked present in a class, kept live by the marking paths"""
+    return class_presence.get(class_id, load_present_students)
+
+def record_scan(mode, timings, stats):
+    """Add one scan to the recognition metrics and keep its timings for the Server-Timing debug header"""
+    recognition_metrics.observe_scan(mode, timings, faces=stats.get('faces', 0), matches=stats.get('matches', 0),
+                                     rejection=stats.get('rejection'), module_id=stats.get('module_id'),
+                                     gallery_size=stats.get('gallery_size'))
+    if has_request_context():
+        g.recognition_timings = timings
+
+def run_timed(func, image_data, module_id, present, timings):
+    """run_recognition, merging the worker's stage timings and booking the rest of the wait as 'pool'"""
+    started = time.perf_counter()
+    match = run_recognition(func, image_data, module_id, present)
+    worker_timings = match.pop('timings', {})
+    timings.merge(worker_timings)
+    timings.add('pool', max(time.perf_counter() - started - sum(worker_timings.values()), 0.0))
+    return match
+
+def record_presence(class_id, student_ids, present=True):
+    """Tell the live already-present set (and so the next scan reply) about attendance just written"""
+    if present:
+        class_presence.mark(class_id, student_ids)
+    else:
+        class_presence.unmark(class_id, student_ids)
+
+def match_frame(image_data, module_id, present=()):
+    """CPU stages of a scan: decode, detect, embed and match against the module gallery
+    
+    The whole gallery is always scored; present (students already marked)
+    only skips the frame once it covers everyone with face data. Touches no
+    attendance rows, so it can run in the recognition process pool. Stage
+    timings come back in the result's 'timings'.
+    """
+    timings = StageTimings()
+    with timings.stage('gallery'):
+        gallery = get_module_gallery(module_id)
+    if gallery.all_present(present):
+        return {'status': 'all_marked', 'gallery_size': len(gallery), 'timings': timings.durations}
+    
+    image = decode_image_data(image_data, timings)
+    if image is None:
+        return {'status': 'invalid_image', 'gallery_size': len(gallery), 'timings': timings.durations}
+    
+    # Extract face embeddings from captured image
+    captured_embeddings = extract_face_embeddings_from_frame(image, timings)
+    if captured_embeddings is None:
+        return {'status': 'no_face', 'gallery_size': len(gallery), 'timings': timings.durations}
+    
+    # Score every enrolled student in one pass
+    with timings.stage('match'):
+        student_id, similarity = gallery.best_match(captured_embeddings)
+    return {
+        'status': 'match' if student_id is not None else 'no_match',
+        'student_id': student_id,
+        'similarity': similarity,
+        'gallery_size': len(gallery),
+        'faces_detected': 1,
+        'timings': timings.durations
+    }
+
+def match_frame_faces(image_data, module_id, present=()):
+    """CPU stages of a group scan: every detected face matched one-to-one against the gallery"""
+    timings = StageTimings()
+    with timings.stage('gallery'):
+        gallery = get_module_gallery(module_id)
+    if gallery.all_present(present):
+        return {'status': 'all_marked', 'gallery_size': len(gallery), 'timings': timings.durations}
+    
+    image = decode_image_data(image_data, timings)
+    if image is None:
+        return {'status': 'invalid_image', 'gallery_size': len(gallery), 'timings': timings.durations}
+    
+    detected = extract_all_face_embeddings_from_frame(image, timings)
+    if not detected:
+        return {'status': 'no_face', 'gallery_size': len(gallery), 'timings': timings.durations}
+    
+    with timings.stage('match'):
+        matches = gallery.match_many([embedding for _, embedding in detected])
+    return {
+        'status': 'match',
+        'faces': [{'box': list(box), 'student_id': student_id, 'similarity': similarity}
+                  for (box, _), (student_id, similarity) in zip(detected, matches)],
+        'gallery_size': len(gallery),
+        'timings': timings.durations
+    }
+
+def recognize_face_from_image(image_data, class_id, confirm_marked=False, scan=None):
+    """Recognize face from image data and mark attendance for specific class session
+    
+    A match on a student already marked present is reported as already
+    marked without a write. Once everyone is marked, frames are skipped
+    unless confirm_marked is set so a rescan can still confirm an earlier
+    mark. scan is the ScanSession the frame arrived on, if any.
+    """
+    timings, stats = StageTimings(), {}
+    result = _recognize_face(image_data, class_id, confirm_marked, scan, timings, stats)
+    record_scan('single', timings, stats)
+    return result
+
+def _recognize_face(image_data, class_id, confirm_marked, scan, timings, stats):
+    try:
+        with timings.stage('lookup'):
+            module_id, class_info, error = resolve_scan_class(class_id, scan)
+            if error:
+                stats['rejection'] = 'class_unavailable'
+                return error
+            present = get_present_students(class_id)
+        
+        stats['module_id'] = module_id
+        match = run_timed(match_frame, image_data, module_id, () if confirm_marked else present, timings)
+        stats.update(gallery_size=match['gallery_size'], faces=match.get('faces_detected', 0))
+        if match['status'] in MATCH_ERRORS:
+            stats['rejection'] = match['status']
+            return {'success': False, 'message': MATCH_ERRORS[match['status']], match['status']: True}
+        
+        current_app.logger.debug(f"Checked {match['gallery_size']} enrolled students for class {class_info}")
+        
+        best_match = None
+        best_similarity = match['similarity']
+        if match['student_id'] is not None:
+            stats['matches'] = 1
+            with timings.stage('db'):
+                best_match = User.query.get(match['student_id'])
+            current_app.logger.debug(f"Best match found: {best_match.full_name} ({best_match.student_number}) - {best_similarity:.2f}")
         
         if best_match:
-            # Check if attendance already exists for THIS SPECIFIC class session (FROM ATTACHED CODE)
-            existing_attendance = Attendance.query.filter_by(
-                student_id=best_match.user_id,
-                class_id=class_id  # Specific to this exact class session
-            ).first()
+            # Mark attendance for THIS SPECIFIC class session unless it already exists (FROM ATTACHED CODE)
+            # A student the live set already has as present needs no write at all
+            created = set()
+            if best_match.user_id not in present:
+                with timings.stage('db'):
+                    created = mark_attendance([(best_match.user_id, class_id)])
+                    db.session.commit()
             
-            if existing_attendance:
+            if not created:
+                stats['rejection'] = 'already_marked'
+                if best_match.user_id not in present:
+                    # Only a repeat scan missed by the live set pays for reading the existing mark back
+                    with timings.stage('db'):
+                        existing_status = db.session.query(Attendance.attendance_status).filter_by(
+                            student_id=best_match.user_id,
+                            class_id=class_id  # Specific to this exact class session
+                        ).scalar()
+                    record_presence(class_id, [best_match.user_id], existing_status == AttendanceStatus.present)
                 return {
                     'success': True,
                     'message': f'Attendance already marked for {best_match.full_name} in {class_info}',
+                    'student_id': best_match.user_id,
                     'student_name': best_match.full_name,
                     'student_number': best_match.student_number,
                     'similarity': round(best_similarity * 100, 2),
@@ -166,21 +771,14 @@ def recognize_face_from_image(image_data, class_id):
                     'class_info': class_info  # FROM ATTACHED CODE
                 }
             else:
-                # Mark attendance for THIS SPECIFIC class session (FROM ATTACHED CODE)
-                attendance = Attendance(
-                    student_id=best_match.user_id,
-                    class_id=class_id,  # Specific to this exact class session
-                    attendance_status=AttendanceStatus.present,
-                    timestamp=datetime.now(timezone.utc).astimezone()
-                )
-                db.session.add(attendance)
-                db.session.commit()
+                record_presence(class_id, [best_match.user_id])
                 
-                print(f"Attendance marked for {best_match.full_name} in {class_info}")  # FROM ATTACHED CODE
+                current_app.logger.debug(f"Attendance marked for {best_match.full_name} in {class_info}")
                 
                 return {
                     'success': True,
                     'message': f'Attendance marked for {best_match.full_name} in {class_info}',
+                    'student_id': best_match.user_id,
                     'student_name': best_match.full_name,
                     'student_number': best_match.student_number,
                     'similarity': round(best_similarity * 100, 2),
@@ -188,36 +786,143 @@ def recognize_face_from_image(image_data, class_id):
                     'class_info': class_info  # FROM ATTACHED CODE
                 }
         else:
+            stats['rejection'] = 'no_match'
             return {'success': False, 'message': 'No matching student found. Please ensure facial data is registered.'}  # ENHANCED MESSAGE FROM ATTACHED CODE
             
+    except RecognitionBusy:
+        stats['rejection'] = 'busy'
+        return {'success': False, 'busy': True, 'message': 'Scanner is busy, please try again in a moment'}
+    except RecognitionTimeout:
+        stats['rejection'] = 'timeout'
+        return {'success': False, 'message': 'Face recognition timed out, please try again'}
     except Exception as e:
         db.session.rollback()  # FROM ATTACHED CODE
+        stats['rejection'] = 'error'
         print(f"Error in face recognition for class {class_id}: {str(e)}")  # FROM ATTACHED CODE
         return {'success': False, 'message': f'Error in face recognition: {str(e)}'}
 
-def extract_face_embeddings_from_frame(image):
-    """Extract face embeddings directly from image frame"""
+def recognize_faces_from_image(image_data, class_id, confirm_marked=False, scan=None):
+    """Recognize every face in a group photo and mark attendance for all matches in one commit"""
+    timings, stats = StageTimings(), {}
+    result = _recognize_faces(image_data, class_id, confirm_marked, scan, timings, stats)
+    record_scan('group', timings, stats)
+    return result
+
+def _recognize_faces(image_data, class_id, confirm_marked, scan, timings, stats):
     try:
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        with timings.stage('lookup'):
+            module_id, class_info, error = resolve_scan_class(class_id, scan)
+            if error:
+                stats['rejection'] = 'class_unavailable'
+                return error
+            present = get_present_students(class_id)
         
-        # Detect face
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.3, 5)
+        stats['module_id'] = module_id
+        match = run_timed(match_frame_faces, image_data, module_id, () if confirm_marked else present, timings)
+        stats['gallery_size'] = match['gallery_size']
+        if match['status'] in MATCH_ERRORS:
+            stats['rejection'] = match['status']
+            return {'success': False, 'message': MATCH_ERRORS[match['status']], match['status']: True}
         
-        if len(faces) == 0:
-            return None
+        detected = match['faces']
+        current_app.logger.debug(f"Matched {len(detected)} faces against {match['gallery_size']} enrolled students for class {class_info}")
+        matched_ids = [face['student_id'] for face in detected if face['student_id'] is not None]
+        stats.update(faces=len(detected), matches=len(matched_ids))
+        
+        students = {}
+        newly_marked = set()
+        if matched_ids:
+            with timings.stage('db'):
+                students = {s.user_id: s for s in User.query.filter(User.user_id.in_(matched_ids)).all()}
+                # One batched insert-if-missing for the matches not already present tells which were new
+                created = mark_attendance([(student_id, class_id) for student_id in matched_ids
+                                           if student_id not in present])
+                db.session.commit()
+            newly_marked = {student_id for student_id, _ in created}
         
-        # Extract largest face (FROM ATTACHED CODE)
-        x, y, w, h = max(faces, key=lambda rect: rect[2] * rect[3])
-        face_roi = gray[y:y+h, x:x+w]
-        face_roi = cv2.resize(face_roi, (100, 100))
+        faces = []
+        for detection in detected:
+            student_id = detection['student_id']
+            face = {'box': detection['box'], 'matched': student_id is not None,
+                    'similarity': round(detection['similarity'] * 100, 2)}
+            if student_id is not None:
+                student = students[student_id]
+                face.update({
+                    'student_id': student_id,
+                    'student_name': student.full_name,
+                    'student_number': student.student_number,
+                    'already_marked': student_id not in newly_marked
+                })
+            faces.append(face)
         
-        # Normalize and flatten
-        face_roi = face_roi.astype(np.float32) / 255.0
-        embeddings = face_roi.flatten()
+        if newly_marked:
+            record_presence(class_id, list(newly_marked))
+        
+        matched_count = len(matched_ids)
+        if not newly_marked:
+            stats['rejection'] = 'already_marked' if matched_count else 'no_match'
+
+        current_app.logger.debug(f"Group scan marked {len(newly_marked)} new attendance records in {class_info}")
+        
+        return {
+            'success': matched_count > 0,
+            'message': f'{len(newly_marked)} marked, {matched_count - len(newly_marked)} already marked, '
+                       f'{len(detected) - matched_count} not recognized in {class_info}',
+            'marked_count': len(newly_marked),
+            'faces': faces,
+            'class_info': class_info
+        }
+    
+    except RecognitionBusy:
+        stats['rejection'] = 'busy'
+        return {'success': False, 'busy': True, 'message': 'Scanner is busy, please try again in a moment'}
+    except RecognitionTimeout:
+        stats['rejection'] = 'timeout'
+        return {'success': False, 'message': 'Face recognition timed out, please try again'}
+    except Exception as e:
+        db.session.rollback()
+        stats['rejection'] = 'error'
+        print(f"Error in group face recognition for class {class_id}: {str(e)}")
+        return {'success': False, 'message': f'Error in face recognition: {str(e)}'}
+
+def _face_embedding(gray, rect):
+    """Crop a detected face, resize to the standard size and flatten it into an embedding"""
+    x, y, w, h = rect
+    face_roi = gray[y:y+h, x:x+w]
+    face_roi = cv2.resize(face_roi, (100, 100))
+    
+    # Normalize and flatten
+    face_roi = face_roi.astype(np.float32) / 255.0
+    return face_roi.flatten()
+
+def extract_all_face_embeddings_from_frame(image, timings=NO_TIMINGS):
+    """Return a (box, embedding) pair for every face detected in an image frame"""
+    try:
+        with timings.stage('detect'):
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            faces = detect_faces(gray, mode='all')
+        with timings.stage('embed'):
+            return [(rect, _face_embedding(gray, rect)) for rect in faces]
+    
+    except Exception as e:
+        print(f"Error extracting embeddings from frame: {e}")
+        return []
+
+def extract_face_embeddings_from_frame(image, timings=NO_TIMINGS):
+    """Extract face embeddings directly from image frame"""
+    try:
+        with timings.stage('detect'):
+            # Convert to grayscale
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            
+            # Detect largest face (FROM ATTACHED CODE)
+            faces = detect_faces(gray, mode='largest')
+        
+        if len(faces) == 0:
+            return None
         
-        return embeddings
+        with timings.stage('embed'):
+            return _face_embedding(gray, faces[0])
         
     except Exception as e:
         print(f"Error extracting embeddings from frame: {e}")
@@ -57,7 +57,10 @@ class AttendanceFilterForm(FlaskForm):
 
 class MarksForm(FlaskForm):
     module_id = SelectField('Module', coerce=int, validators=[DataRequired()])
+    all_modules = BooleanField('All my modules', default=False)
     submit = SubmitField('Calculate Marks')
+    export_csv = SubmitField('Export CSV')
+    export_xlsx = SubmitField('Export Excel')
 
 class AdminAddUserForm(FlaskForm):
     full_name = StringField('Full Name', validators=[DataRequired(), Length(min=2, max=100)])
@@ -0,0 +1,55 @@
+# image_cache.py - small in-process cache of hot face image bytes
+import threading
+from collections import OrderedDict
+from config import Config
+
+class ImageCache:
+    """LRU cache of file contents bounded by total bytes; max_bytes=0 disables it
+
+    Entries are keyed by (key, etag) so a replaced image is never served stale.
+    """
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, etag, load):
+        """Cached bytes of path, calling load(path) on a miss"""
+        key = (path, etag)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+
+        data = load(path)
+
+        if 0 < len(data) <= self.max_bytes:
+            with self._lock:
+                # Older versions of the same file can't be requested again
+                for stale in [k for k in self._entries if k[0] == path and k != key]:
+                    self.nbytes -= len(self._entries.pop(stale))
+                if key not in self._entries:
+                    self._entries[key] = data
+                    self.nbytes += len(data)
+                while self.nbytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.nbytes -= len(evicted)
+        return data
+
+    def discard(self, path):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == path]:
+                self.nbytes -= len(self._entries.pop(key))
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.nbytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+face_image_cache = ImageCache(Config.FACE_IMAGE_CACHE_BYTES)
@@ -64,6 +64,7 @@ class Module(db.Model):
 
 class ClassSession(db.Model):  
     __tablename__ = 'classes'
+    __table_args__ = (db.Index('ix_classes_lecturer_date', 'lecturer_id', 'class_date'),)
     class_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     module_id = db.Column(db.Integer, db.ForeignKey('modules.module_id'), nullable=False)
     lecturer_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
@@ -85,6 +86,7 @@ class ClassSession(db.Model):
 
 class Enrollment(db.Model):
     __tablename__ = 'enrollments'
+    __table_args__ = (db.UniqueConstraint('module_id', 'student_id', name='uq_enrollments_module_student'),)
     enrollment_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     student_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
     module_id = db.Column(db.Integer, db.ForeignKey('modules.module_id'), nullable=False)
@@ -113,6 +115,7 @@ class Assignment(db.Model):
 
 class Attendance(db.Model):
     __tablename__ = 'attendance'
+    __table_args__ = (db.UniqueConstraint('class_id', 'student_id', name='uq_attendance_class_student'),)
     attendance_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     student_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
     class_id = db.Column(db.Integer, db.ForeignKey('classes.class_id'), nullable=False)
@@ -130,9 +133,14 @@ class Attendance(db.Model):
 class FacialData(db.Model):
     __tablename__ = 'facial_data'
     facial_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    student_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False, index=True)
     image_path = db.Column(db.String(255), nullable=False)
     uploaded_at = db.Column(db.TIMESTAMP, server_default=db.func.current_timestamp(), nullable=False)
+    embedding = db.Column(db.LargeBinary, nullable=True)  # float32 vector computed at upload time
+    embedding_version = db.Column(db.Integer, nullable=True)
+    projected_embedding = db.Column(db.LargeBinary, nullable=True)  # embedding reduced by the PCA projection
+    projection_version = db.Column(db.Integer, nullable=True)
+    thumbnail_path = db.Column(db.String(255), nullable=True)  # small roster image, named by content hash
 
     # Relationships
     student = db.relationship('User', back_populates='facial_data')
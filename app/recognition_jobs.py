@@ -0,0 +1,215 @@
+# recognition_jobs.py - bounded queue of recognition jobs so scans don't hold a web worker
+import json
+import math
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import deque
+import numpy as np
+from config import Config
+
+BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+class JobQueueFull(Exception):
+    """Raised when RECOGNITION_JOB_QUEUE jobs are already waiting"""
+    def __init__(self, retry_after):
+        super().__init__(f'Recognition queue is full, retry in {retry_after}s')
+        self.retry_after = retry_after
+
+class RecognitionJob:
+    def __init__(self, func, args, kwargs, owner_id):
+        self.job_id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.owner_id = owner_id
+        self.status = 'queued'
+        self.result = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        data = {'job_id': self.job_id, 'status': self.status}
+        if self.status == 'done':
+            data['result'] = self.result
+        return data
+
+    def to_record(self):
+        """What the job's status file holds: to_dict() plus the owner poll requests are checked against"""
+        return dict(self.to_dict(), owner_id=self.owner_id)
+
+def _summary(samples):
+    """Mean and 95th percentile (in ms) of a window of durations in seconds"""
+    if not samples:
+        return {'avg_ms': 0.0, 'p95_ms': 0.0}
+    values = np.fromiter(samples, dtype=np.float64) * 1000
+    return {'avg_ms': round(float(values.mean()), 2), 'p95_ms': round(float(np.percentile(values, 95)), 2)}
+
+class RecognitionQueue:
+    """Recognition jobs accepted immediately and run by a fixed set of worker threads
+
+    Submitting never blocks: a full queue raises JobQueueFull with a
+    Retry-After estimate. Each job's status and result are written to a JSON
+    file in folder, so a poll answered by any web worker on the host can read
+    it. Files are removed result_ttl seconds after their last change.
+    """
+    def __init__(self, folder, max_depth=64, workers=4, result_ttl=120):
+        self.folder = folder
+        self.max_depth = max_depth
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._jobs = {}  # jobs accepted by this process, so a local poll can wait on the job itself
+        self._pruned_at = 0.0
+        self._threads = []
+        self._lock = threading.Lock()
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_times = deque(maxlen=500)
+        self._service_times = deque(maxlen=500)
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'recognition-job-{n}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def retry_after(self):
+        """Seconds until a slot is likely to free up, from the recent service time"""
+        service = (sum(self._service_times) / len(self._service_times)) if self._service_times else 1.0
+        return max(1, math.ceil(self._queue.qsize() * service / max(self.workers, 1)))
+
+    def submit(self, func, *args, owner_id=None, **kwargs):
+        """Queue func(*args, **kwargs) and return the job without waiting for it"""
+        self._start()
+        self._prune()
+        job = RecognitionJob(func, args, kwargs, owner_id)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise JobQueueFull(self.retry_after())
+        with self._lock:
+            self._jobs[job.job_id] = job
+        self._save(job)
+        return job
+
+    def _path(self, job_id):
+        return os.path.join(self.folder, f'{job_id}.json')
+
+    def _save(self, job):
+        # Write then rename, so a reader in another process never sees half a file
+        os.makedirs(self.folder, exist_ok=True)
+        temporary = self._path(job.job_id) + f'.{os.getpid()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(job.to_record(), f)
+        os.replace(temporary, self._path(job.job_id))
+
+    def get(self, job_id, wait=0):
+        """Status record of job_id from whichever worker accepted it, or None
+
+        With wait, blocks up to that many seconds for the job to finish.
+        """
+        if not JOB_ID.match(job_id):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            if wait > 0:
+                job.done.wait(wait)
+            return job.to_record()
+
+        deadline = time.monotonic() + wait
+        while True:
+            try:
+                with open(self._path(job_id)) as f:
+                    record = json.load(f)
+            except FileNotFoundError:
+                return None
+            if record['status'] == 'done' or time.monotonic() >= deadline:
+                return record
+            time.sleep(0.05)
+
+    def _work(self):
+        from app import app, db
+        while True:
+            job = self._queue.get()
+            job.started_at = time.monotonic()
+            job.status = 'running'
+            with self._lock:
+                self._running += 1
+            self._save(job)
+            try:
+                with app.app_context():
+                    try:
+                        job.result = job.func(*job.args, **job.kwargs)
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                print(f"Recognition job {job.job_id} failed: {str(e)}")
+                job.result = {'success': False, 'message': f'Error in face recognition: {str(e)}'}
+            finally:
+                job.finished_at = time.monotonic()
+                job.status = 'done'
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                    self._wait_times.append(job.started_at - job.submitted_at)
+                    self._service_times.append(job.finished_at - job.started_at)
+                try:
+                    self._save(job)
+                except (OSError, TypeError, ValueError) as e:
+                    print(f"Could not save recognition job {job.job_id}: {str(e)}")
+                job.done.set()
+                self._queue.task_done()
+
+    def _prune(self):
+        now = time.monotonic()
+        with self._lock:
+            for job_id in [j for j, job in self._jobs.items()
+                           if job.finished_at is not None and now - job.finished_at > self.result_ttl]:
+                del self._jobs[job_id]
+            if now - self._pruned_at < 10:
+                return
+            self._pruned_at = now
+
+        # Every worker prunes the shared folder now and then, including files left by workers that died
+        cutoff = time.time() - self.result_ttl
+        try:
+            names = os.listdir(self.folder)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.folder, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': self._queue.qsize(),
+                'max_depth': self.max_depth,
+                'workers': self.workers,
+                'running': self._running,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'wait_time': _summary(self._wait_times),
+                'service_time': _summary(self._service_times)
+            }
+
+recognition_queue = RecognitionQueue(os.path.join(BASE_DIR, Config.RECOGNITION_JOB_FOLDER), Config.RECOGNITION_JOB_QUEUE,
+                                     Config.RECOGNITION_JOB_WORKERS, Config.RECOGNITION_JOB_RESULT_TTL)
@@ -0,0 +1,247 @@
+# recognition_metrics.py - per-stage timings and counters of face recognition, in Prometheus text format
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from config import Config
+
+BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class StageTimings:
+    """Wall time spent in each stage of one scan
+
+    Kept as a plain dict so timings taken in a recognition pool worker can be
+    returned with the job result and merged into the web process's copy.
+    """
+    def __init__(self):
+        self.durations = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def merge(self, durations):
+        for name, seconds in (durations or {}).items():
+            self.add(name, seconds)
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Server-Timing header value (durations in ms, as browsers' devtools expect)"""
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.durations.items()]
+        parts.append(f"total;dur={self.total() * 1000:.2f}")
+        return ', '.join(parts)
+
+class _NullTimings(StageTimings):
+    """Stand-in for callers that don't collect timings"""
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def add(self, name, seconds):
+        pass
+
+NO_TIMINGS = _NullTimings()
+
+class Histogram:
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        return {'counts': self.counts, 'count': self.count, 'sum': self.sum}
+
+    def merge(self, data):
+        self.counts = [a + b for a, b in zip(self.counts, data['counts'])]
+        self.count += data['count']
+        self.sum += data['sum']
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}' if labels else ''
+
+def _add_counts(total, counts):
+    for key, count in counts.items():
+        total[key] = total.get(key, 0) + count
+
+class RecognitionMetrics:
+    """Stage latency histograms and scan counters, summed over every web worker process
+
+    Each process writes a snapshot of its own metrics to a JSON file in folder
+    every flush_interval seconds, and render() adds up all the snapshots, so a
+    scrape gives the same totals whichever worker answers it. Snapshots of
+    processes that have exited are kept so counters never go backwards; their
+    gauges are dropped once the snapshot is older than a few flush intervals.
+    """
+    def __init__(self, folder, flush_interval=1.0):
+        self.folder = folder
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._gauges = []  # (name, help, func) sampled at every flush
+        self._pid = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.frames = {}
+            self.faces_detected = 0
+            self.matches = 0
+            self.rejections = {}
+            self.gallery_sizes = {}  # module_id -> (size, wall time of the scan)
+
+    def add_gauge(self, name, help_text, func):
+        """Report func() as a gauge, summed over the live worker processes"""
+        self._gauges.append((name, help_text, func))
+
+    def _start(self):
+        """Start this process's flusher once; a forked child gets fresh metrics and its own file"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            forked = self._pid is not None
+            self._pid = os.getpid()
+            self._path = os.path.join(self.folder, f'{self._pid}-{uuid.uuid4().hex[:8]}.json')
+        if forked:
+            self.reset()
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Could not write recognition metrics: {str(e)}")
+
+    def _snapshot(self):
+        gauges = {}
+        for name, help_text, func in self._gauges:
+            try:
+                gauges[name] = func()
+            except Exception:
+                continue
+        with self._lock:
+            return {
+                'written_at': time.time(),
+                'stages': {name: histogram.to_dict() for name, histogram in self.stages.items()},
+                'frames': dict(self.frames),
+                'faces_detected': self.faces_detected,
+                'matches': self.matches,
+                'rejections': dict(self.rejections),
+                'gallery_sizes': {str(module_id): entry for module_id, entry in self.gallery_sizes.items()},
+                'gauges': gauges
+            }
+
+    def flush(self):
+        """Write this process's snapshot (write then rename, so a scrape never reads half a file)"""
+        self._start()
+        snapshot = self._snapshot()
+        os.makedirs(self.folder, exist_ok=True)
+        temporary = self._path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(temporary, self._path)
+
+    def observe_scan(self, mode, timings, faces=0, matches=0, rejection=None, module_id=None, gallery_size=None):
+        """Record one recognized frame: its stage timings, face/match counts and why it was rejected, if it was"""
+        self._start()
+        total = timings.total()
+        with self._lock:
+            for name, seconds in list(timings.durations.items()) + [('total', total)]:
+                self.stages.setdefault(name, Histogram()).observe(seconds)
+            self.frames[mode] = self.frames.get(mode, 0) + 1
+            self.faces_detected += faces
+            self.matches += matches
+            if rejection:
+                self.rejections[rejection] = self.rejections.get(rejection, 0) + 1
+            if module_id is not None and gallery_size is not None:
+                self.gallery_sizes[module_id] = (gallery_size, time.time())
+
+    def _combined(self):
+        """Every process's latest snapshot added together, with this process's taken fresh"""
+        self.flush()
+        stages, frames, rejections, gallery_sizes, gauges = {}, {}, {}, {}, {}
+        faces_detected = matches = 0
+        live_after = time.time() - 5 * self.flush_interval
+        for name in os.listdir(self.folder):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.folder, name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for stage, data in snapshot['stages'].items():
+                stages.setdefault(stage, Histogram()).merge(data)
+            _add_counts(frames, snapshot['frames'])
+            _add_counts(rejections, snapshot['rejections'])
+            faces_detected += snapshot['faces_detected']
+            matches += snapshot['matches']
+            for module_id, (size, seen_at) in snapshot['gallery_sizes'].items():
+                if module_id not in gallery_sizes or gallery_sizes[module_id][1] < seen_at:
+                    gallery_sizes[module_id] = (size, seen_at)
+            if snapshot['written_at'] >= live_after:
+                _add_counts(gauges, snapshot['gauges'])
+        return stages, frames, faces_detected, matches, rejections, gallery_sizes, gauges
+
+    def render(self):
+        """Prometheus text exposition of everything recorded so far by every worker process"""
+        stages, frames, faces_detected, matches, rejections, gallery_sizes, gauges = self._combined()
+        lines = ['# HELP recognition_stage_seconds Time spent in each recognition stage.',
+                 '# TYPE recognition_stage_seconds histogram']
+        for stage, histogram in sorted(stages.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'recognition_stage_seconds_bucket{_labels(stage=stage, le=bound)} {cumulative}')
+            lines.append(f'recognition_stage_seconds_bucket{_labels(stage=stage, le="+Inf")} {histogram.count}')
+            lines.append(f'recognition_stage_seconds_sum{_labels(stage=stage)} {histogram.sum:.6f}')
+            lines.append(f'recognition_stage_seconds_count{_labels(stage=stage)} {histogram.count}')
+
+        lines += ['# HELP recognition_frames_total Frames submitted for recognition.',
+                  '# TYPE recognition_frames_total counter']
+        lines += [f'recognition_frames_total{_labels(mode=mode)} {count}' for mode, count in sorted(frames.items())]
+        lines += ['# HELP recognition_faces_detected_total Faces found by the detector.',
+                  '# TYPE recognition_faces_detected_total counter',
+                  f'recognition_faces_detected_total {faces_detected}',
+                  '# HELP recognition_matches_total Faces matched to an enrolled student.',
+                  '# TYPE recognition_matches_total counter',
+                  f'recognition_matches_total {matches}',
+                  '# HELP recognition_rejections_total Frames that marked nobody, by reason.',
+                  '# TYPE recognition_rejections_total counter']
+        lines += [f'recognition_rejections_total{_labels(reason=reason)} {count}'
+                  for reason, count in sorted(rejections.items())]
+        lines += ['# HELP recognition_gallery_size Faces in the module gallery at its last scan.',
+                  '# TYPE recognition_gallery_size gauge']
+        lines += [f'recognition_gallery_size{_labels(module_id=module_id)} {size}'
+                  for module_id, (size, _) in sorted(gallery_sizes.items(), key=lambda item: int(item[0]))]
+
+        for name, help_text, _ in self._gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {gauges.get(name, 0)}']
+        return '\n'.join(lines) + '\n'
+
+recognition_metrics = RecognitionMetrics(os.path.join(BASE_DIR, Config.METRICS_FOLDER))
@@ -0,0 +1,117 @@
+# recognition_pool.py - runs the CPU-bound stages of face recognition in a process pool
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from config import Config
+from app.face_gallery import gallery_cache
+
+class RecognitionBusy(Exception):
+    """Raised when the pool already has RECOGNITION_QUEUE_DEPTH jobs in flight"""
+
+class RecognitionTimeout(Exception):
+    """Raised when a job takes longer than RECOGNITION_JOB_TIMEOUT"""
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(Config.RECOGNITION_QUEUE_DEPTH, 1))
+
+# Gallery versions last seen by this process when it is a pool worker
+_seen_epoch = None
+_seen_module_epochs = {}
+
+def _init_worker():
+    """Parse the cascade once when a worker starts instead of on its first job"""
+    from app.face_detector import detect_faces
+    detect_faces(np.zeros((64, 64), dtype=np.uint8))
+
+def _sync_gallery(module_id, version):
+    """Drop this worker's cached gallery if the web process has invalidated it since"""
+    global _seen_epoch
+    epoch, module_epoch = version
+    if epoch != _seen_epoch:
+        gallery_cache.clear()
+        _seen_epoch = epoch
+        _seen_module_epochs.clear()
+    elif _seen_module_epochs.get(module_id) != module_epoch:
+        gallery_cache.invalidate(module_id)
+    _seen_module_epochs[module_id] = module_epoch
+
+def _run_job(func, version, image_data, module_id, *args):
+    from app import app, db
+    with app.app_context():
+        _sync_gallery(module_id, version)
+        try:
+            return func(image_data, module_id, *args)
+        finally:
+            db.session.remove()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, not fork: the web process holds DB connections and threads
+            _executor = ProcessPoolExecutor(
+                max_workers=Config.RECOGNITION_POOL_SIZE,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker
+            )
+        return _executor
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+def run_recognition(func, image_data, module_id, *args):
+    """Run func(image_data, module_id, *args) in the pool and return its result
+    
+    Runs inline when RECOGNITION_POOL_SIZE is 0. Raises RecognitionBusy when
+    the queue is full and RecognitionTimeout when the job overruns.
+    """
+    if Config.RECOGNITION_POOL_SIZE <= 0:
+        return func(image_data, module_id, *args)
+    
+    if not _slots.acquire(blocking=False):
+        raise RecognitionBusy()
+    
+    try:
+        future = _get_executor().submit(_run_job, func, gallery_cache.version(module_id), image_data, module_id, *args)
+    except BrokenProcessPool:
+        _slots.release()
+        _reset_executor()
+        raise
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda f: _slots.release())
+    
+    try:
+        return future.result(timeout=Config.RECOGNITION_JOB_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        raise RecognitionTimeout()
+    except BrokenProcessPool:
+        _reset_executor()
+        raise
+
+def warm_workers(func, module_id):
+    """Have the pool workers run func(None, module_id) ahead of the first scan, without waiting
+    
+    Jobs are handed to idle workers, so with one job per worker each usually gets one.
+    """
+    if Config.RECOGNITION_POOL_SIZE <= 0:
+        return
+    version = gallery_cache.version(module_id)
+    for _ in range(Config.RECOGNITION_POOL_SIZE):
+        try:
+            _get_executor().submit(_run_job, func, version, None, module_id)
+        except BrokenProcessPool:
+            _reset_executor()
+            return
+
+def shutdown_pool():
+    _reset_executor()
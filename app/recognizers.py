@@ -0,0 +1,230 @@
+# recognizers.py - pluggable face recognition engines
+import io
+from abc import ABC, abstractmethod
+import numpy as np
+import cv2
+from config import Config
+
+FACE_SIZE = (100, 100)  # crop size behind every raw embedding
+
+class RecognizerBackend(ABC):
+    """Base class for a recognition engine holding the enrolled faces of one gallery
+    
+    enroll() takes vectors in the engine's stored form (see prepare()), while
+    identify() takes a batch of raw embeddings and returns an
+    (n_queries, n_enrolled) similarity matrix where higher is better, with
+    columns in the order of student_ids. An optional boolean mask over
+    student_ids limits scoring to those columns.
+    """
+    name = None
+    threshold = 0.6
+    projection = None  # FaceProjection whose vectors enroll() expects, if any
+    
+    def __init__(self):
+        self.student_ids = np.empty(0, dtype=np.int64)
+    
+    def __len__(self):
+        return len(self.student_ids)
+    
+    @property
+    def key(self):
+        """Identifies the engine and model a gallery was built with"""
+        return (self.name, self.projection.version if self.projection is not None else None)
+    
+    @property
+    def nbytes(self):
+        return self.student_ids.nbytes
+    
+    def prepare(self, embeddings):
+        """Convert raw (n, 10000) embeddings to the form stored by enroll()"""
+        return np.asarray(embeddings, dtype=np.float32)
+    
+    @abstractmethod
+    def enroll(self, student_ids, vectors):
+        pass
+    
+    @abstractmethod
+    def remove(self, student_ids):
+        pass
+    
+    @abstractmethod
+    def identify(self, embeddings, mask=None):
+        pass
+    
+    @abstractmethod
+    def serialize(self):
+        pass
+    
+    @classmethod
+    @abstractmethod
+    def load(cls, data, **kwargs):
+        pass
+
+class _CosineBackend(RecognizerBackend):
+    """Cosine similarity against an L2-normalized matrix, scored with one matrix product"""
+    def __init__(self):
+        super().__init__()
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+    
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + self.student_ids.nbytes
+    
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+    
+    def enroll(self, student_ids, vectors):
+        student_ids = np.asarray(student_ids, dtype=np.int64)
+        if not len(student_ids):
+            return
+        self.remove(student_ids)
+        rows = self._normalize(np.vstack(vectors).astype(np.float32))
+        self.matrix = np.vstack([self.matrix, rows]) if len(self) else rows
+        self.student_ids = np.concatenate([self.student_ids, student_ids])
+    
+    def remove(self, student_ids):
+        keep = ~np.isin(self.student_ids, student_ids)
+        if not keep.all():
+            self.student_ids = self.student_ids[keep]
+            self.matrix = self.matrix[keep]
+    
+    def identify(self, embeddings, mask=None):
+        queries = self._normalize(self.prepare(np.atleast_2d(embeddings)))
+        matrix = self.matrix if mask is None else self.matrix[mask]
+        if len(matrix) == 0:
+            return np.empty((len(queries), 0), dtype=np.float32)
+        return queries @ matrix.T
+    
+    def serialize(self):
+        buffer = io.BytesIO()
+        np.savez(buffer, student_ids=self.student_ids, matrix=self.matrix)
+        return buffer.getvalue()
+    
+    def _load_arrays(self, data):
+        with np.load(io.BytesIO(data)) as arrays:
+            self.student_ids = arrays['student_ids']
+            self.matrix = arrays['matrix']
+        return self
+
+class RawPixelRecognizer(_CosineBackend):
+    """The original engine: cosine similarity over the flattened 100x100 grayscale crop"""
+    name = 'raw'
+    
+    @classmethod
+    def load(cls, data, **kwargs):
+        return cls()._load_arrays(data)
+
+class ProjectionRecognizer(_CosineBackend):
+    """Cosine similarity over PCA-projected embeddings (see face_projection)"""
+    name = 'pca'
+    
+    def __init__(self, projection):
+        super().__init__()
+        self.projection = projection
+    
+    def prepare(self, embeddings):
+        return self.projection.project(embeddings)
+    
+    @classmethod
+    def load(cls, data, projection=None, **kwargs):
+        return cls(projection)._load_arrays(data)
+
+class LBPHRecognizer(RecognizerBackend):
+    """OpenCV's Local Binary Patterns Histograms recognizer (needs opencv-contrib's cv2.face)"""
+    name = 'lbph'
+    threshold = 0.6
+    distance_scale = 150.0  # LBPH chi-square distance mapped to similarity = 1 - d / scale
+    
+    def __init__(self):
+        super().__init__()
+        self._faces = {}  # student_id -> 100x100 uint8 crop, kept so removals can retrain
+        self._model = None
+    
+    @property
+    def nbytes(self):
+        return sum(face.nbytes for face in self._faces.values()) + self.student_ids.nbytes
+    
+    def prepare(self, embeddings):
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        return np.clip(embeddings * 255.0, 0, 255).astype(np.uint8).reshape(-1, *FACE_SIZE)
+    
+    def _train(self):
+        self.student_ids = np.fromiter(self._faces.keys(), dtype=np.int64)
+        self._model = None
+        if self._faces:
+            self._model = cv2.face.LBPHFaceRecognizer_create()
+            self._model.train(list(self._faces.values()), self.student_ids.astype(np.int32))
+    
+    def enroll(self, student_ids, vectors):
+        for student_id, face in zip(student_ids, vectors):
+            self._faces[int(student_id)] = np.asarray(face, dtype=np.uint8).reshape(FACE_SIZE)
+        self._train()
+    
+    def remove(self, student_ids):
+        for student_id in np.atleast_1d(student_ids):
+            self._faces.pop(int(student_id), None)
+        self._train()
+    
+    def identify(self, embeddings, mask=None):
+        faces = self.prepare(embeddings)
+        scores = np.zeros((len(faces), len(self)), dtype=np.float32)
+        if self._model is None:
+            return scores
+        
+        column = {int(student_id): i for i, student_id in enumerate(self.student_ids)}
+        for row, face in enumerate(faces):
+            collector = cv2.face.StandardCollector_create()
+            self._model.predict_collect(face, collector)
+            for label, distance in collector.getResults(False):
+                scores[row, column[int(label)]] = max(0.0, 1.0 - distance / self.distance_scale)
+        # predict_collect always scores every face, so masking only trims the result
+        return scores if mask is None else scores[:, mask]
+    
+    def serialize(self):
+        buffer = io.BytesIO()
+        np.savez(buffer, student_ids=np.fromiter(self._faces.keys(), dtype=np.int64),
+                 faces=np.array(list(self._faces.values()), dtype=np.uint8).reshape(-1, *FACE_SIZE))
+        return buffer.getvalue()
+    
+    @classmethod
+    def load(cls, data, **kwargs):
+        backend = cls()
+        with np.load(io.BytesIO(data)) as arrays:
+            backend.enroll(arrays['student_ids'], arrays['faces'])
+        return backend
+
+def available_backends():
+    """Names of the engines that can run in this environment"""
+    names = ['raw', 'pca']
+    if hasattr(cv2, 'face'):
+        names.append('lbph')
+    return names
+
+def _resolve(name, projection):
+    name = name or Config.RECOGNIZER_BACKEND
+    if name not in ('raw', 'pca', 'lbph'):
+        raise ValueError(f"Unknown recognizer backend: {name}")
+    if name == 'pca' and projection is None:
+        return 'raw'  # no projection fitted yet
+    if name == 'lbph' and not hasattr(cv2, 'face'):
+        return 'raw'
+    return name
+
+def backend_key(name=None, projection=None):
+    """The key create_backend(name, projection) would produce, without building anything"""
+    name = _resolve(name, projection)
+    return (name, projection.version if name == 'pca' else None)
+
+def create_backend(name=None, projection=None):
+    """Create the configured engine, falling back to 'raw' when its requirements are missing"""
+    resolved = _resolve(name, projection)
+    if resolved == 'pca':
+        return ProjectionRecognizer(projection)
+    if resolved == 'lbph':
+        return LBPHRecognizer()
+    if (name or Config.RECOGNIZER_BACKEND) == 'lbph':
+        print("cv2.face is not available (install opencv-contrib-python), using the raw engine")
+    return RawPixelRecognizer()
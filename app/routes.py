@@ -1,4 +1,4 @@
-from flask import jsonify, render_template, redirect, session, url_for, flash, request, send_file, make_response, Response
+from flask import g, jsonify, render_template, redirect, session, url_for, flash, request, send_file, make_response, Response
 import pandas as pd
 from app import app, db
 from app.models import ClassType, User, Role, FacialData, ClassSession, Module, Attendance, AttendanceStatus, Assignment, Enrollment
@@ -7,29 +7,73 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 import os
 from werkzeug.utils import secure_filename
-from app.facial_recognition import recognize_face_from_image, verify_face
+from app.facial_recognition import get_present_students, identify_walk_in, index_face, ingest_face_image, open_scan_session, prewarm_galleries, record_presence, recognize_face_from_image, recognize_faces_from_image, set_face_embedding, store_face_images, unindex_face
+from app.face_detector import detector_stats
+from app.face_gallery import class_presence, gallery_cache
+from app.face_import import face_imports
+from app.attendance import mark_attendance
+from app.class_counters import class_counters
+from app.face_storage import content_hash, face_store, release_face_blobs
+from app.image_cache import face_image_cache
+from app.recognition_jobs import JobQueueFull, recognition_queue
+from app.recognition_metrics import recognition_metrics
+from app.scan_sessions import scan_sessions
+from app.student_summary import student_summaries
 from datetime import datetime, timezone, date
 from config import Config
 import base64
+import gzip
+import hashlib
+import hmac
 from sqlalchemy import case, func, extract
+from sqlalchemy.orm import joinedload
 import calendar
 from collections import defaultdict
 import io
 import csv
 import json
+import re
+import time
 from sqlalchemy.exc import IntegrityError
+from werkzeug.http import is_resource_modified
 
-# Get the absolute path to the facial_data folder
 BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
-UPLOAD_FOLDER = os.path.join(BASE_DIR, Config.UPLOAD_FOLDER)
 ALLOWED_EXTENSIONS = Config.ALLOWED_EXTENSIONS
 
-# Make sure the upload folder exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def thumbnail_etag(thumbnail_path):
+    """Content hash a thumbnail was stored under (also parses legacy thumbs/student_<number>_<hash>.jpg)"""
+    return os.path.splitext(os.path.basename(thumbnail_path))[0].rsplit('_', 1)[-1][:16]
+
+def face_image_validators(facial_data):
+    """ETag and Last-Modified of a stored face image, from its row alone so a 304 needs no disk read"""
+    uploaded_at = facial_data.uploaded_at
+    etag = content_hash(facial_data.image_path)
+    if etag is None:
+        etag = hashlib.sha256(f"{facial_data.image_path}:{uploaded_at.isoformat()}".encode()).hexdigest()
+    return etag[:16], uploaded_at
+
+def private_image_response(response, etag, last_modified):
+    """Private (never shared-cache) validators: browsers keep the image but revalidate each use"""
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def compressed_json(data):
+    """jsonify, gzipped when large and the browser accepts it (Config.COMPRESS_JSON_RESPONSES)"""
+    response = jsonify(data)
+    if Config.COMPRESS_JSON_RESPONSES and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = response.get_data()
+        if len(body) > 1024:
+            response.set_data(gzip.compress(body, compresslevel=6))
+            response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
 
 @app.route('/upload_face', methods=['POST'])
 @login_required
@@ -52,39 +96,32 @@ def upload_face_route():
         return redirect(url_for('profile'))
     
     if file and allowed_file(file.filename):
-        filename = f"student_{current_user.student_number}.jpg"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-
-        file.save(filepath)
+        # Decode, detect and embed in memory; only a verified face crop is ever written
+        face_jpeg, embeddings, message = ingest_face_image(file.read())
         
-        # Verify the image contains a face
-        is_valid, message = verify_face(filepath, current_user.student_number, UPLOAD_FOLDER)
-        
-        if is_valid:
+        if message is None:
             existing_data = FacialData.query.filter_by(student_id=current_user.user_id).first()
             
             if existing_data:
-                if existing_data.image_path != filename:
-                    old_filepath = os.path.join(UPLOAD_FOLDER, existing_data.image_path)
-                    if os.path.exists(old_filepath):
-                        os.remove(old_filepath)
-
-                existing_data.image_path = filename
+                replaced = store_face_images(existing_data, face_jpeg)
                 existing_data.uploaded_at = datetime.now(timezone.utc).astimezone()
+                set_face_embedding(existing_data, embeddings)
                 db.session.commit()
+                release_face_blobs(replaced)
+                index_face(existing_data)
                 flash('Facial data updated successfully!', 'success')
             else:
                 facial_data = FacialData(
                     student_id=current_user.user_id,
-                    image_path=filename,
                     uploaded_at=datetime.now(timezone.utc).astimezone()
                 )
+                store_face_images(facial_data, face_jpeg)
+                set_face_embedding(facial_data, embeddings)
                 db.session.add(facial_data)
                 db.session.commit()
+                index_face(facial_data)
                 flash('Facial data saved successfully!', 'success')
         else:
-            if os.path.exists(filepath):
-                os.remove(filepath)
             flash(f'Invalid image: {message}', 'danger')
     else:
         flash('Invalid file type. Please upload PNG, JPG, or JPEG.', 'danger')
@@ -103,12 +140,52 @@ def view_face(student_id):
         flash('No facial data found.', 'danger')
         return redirect(url_for('profile'))
     
-    filepath = os.path.join(UPLOAD_FOLDER, facial_data.image_path)
-    if not os.path.exists(filepath):
+    etag, last_modified = face_image_validators(facial_data)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return private_image_response(Response(status=304), etag, last_modified)
+    
+    if not face_store.exists(facial_data.image_path):
         flash('Image file not found.', 'danger')
         return redirect(url_for('profile'))
     
-    return send_file(filepath, mimetype='image/jpeg')
+    image = face_image_cache.get(facial_data.image_path, etag, face_store.read)
+    return private_image_response(Response(image, mimetype='image/jpeg'), etag, last_modified)
+
+@app.route('/face_thumbnail/<int:student_id>')
+@login_required
+def face_thumbnail(student_id):
+    """Roster thumbnail; URLs carry the content hash (?v=) so browsers may cache them for good"""
+    if current_user.role == Role.lecturer:
+        teaches_student = db.session.query(Enrollment.enrollment_id).join(
+            ClassSession, ClassSession.module_id == Enrollment.module_id
+        ).filter(
+            Enrollment.student_id == student_id,
+            ClassSession.lecturer_id == current_user.user_id
+        ).first()
+        if not teaches_student:
+            return jsonify({'error': 'Permission denied'}), 403
+    elif current_user.role != Role.admin and current_user.user_id != student_id:
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    facial_data = FacialData.query.filter_by(student_id=student_id).first()
+    if not facial_data or not facial_data.thumbnail_path:
+        return jsonify({'error': 'No thumbnail found'}), 404
+    
+    if not face_store.exists(facial_data.thumbnail_path):
+        return jsonify({'error': 'Thumbnail file not found'}), 404
+    
+    # A versioned URL never changes content; an unversioned one must be revalidated
+    etag = thumbnail_etag(facial_data.thumbnail_path)
+    versioned = request.args.get('v') == etag
+    source = face_store.local_path(facial_data.thumbnail_path)
+    if source is None:
+        source = io.BytesIO(face_store.read(facial_data.thumbnail_path))
+    response = send_file(source, mimetype='image/jpeg', etag=etag, conditional=True,
+                         max_age=365 * 24 * 3600 if versioned else None)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = versioned
+    return response
 
 @app.route('/get_face_image/<int:student_id>')
 @login_required
@@ -120,14 +197,20 @@ def get_face_image(student_id):
     if not facial_data:
         return jsonify({'error': 'No facial data found'}), 404
     
-    filepath = os.path.join(UPLOAD_FOLDER, facial_data.image_path)
-    if not os.path.exists(filepath):
+    # The JSON body is a different representation from view_face, so it gets its own ETag
+    etag, last_modified = face_image_validators(facial_data)
+    json_etag = f"{etag}-json"
+    if not is_resource_modified(request.environ, etag=json_etag, last_modified=last_modified):
+        return private_image_response(Response(status=304), json_etag, last_modified)
+    
+    if not face_store.exists(facial_data.image_path):
         return jsonify({'error': 'Image file not found'}), 404
 
     try:
-        with open(filepath, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        return jsonify({'image': f"data:image/jpeg;base64,{encoded_string}"})
+        image = face_image_cache.get(facial_data.image_path, etag, face_store.read)
+        encoded_string = base64.b64encode(image).decode('utf-8')
+        return private_image_response(jsonify({'image': f"data:image/jpeg;base64,{encoded_string}"}),
+                                      json_etag, last_modified)
     except Exception as e:
         return jsonify({'error': f'Error reading image: {str(e)}'}), 500
 
@@ -255,6 +338,49 @@ def lecturer_dashboard():
     
     return render_template('lecturer_dashboard.html', total_classes=total_classes, total_students=total_students, avg_attendance=avg_attendance)
 
+def load_student_summary(student_id):
+    """Per-module session and present counts for a student's enrolled modules, in one GROUP BY query"""
+    present = db.and_(
+        Attendance.class_id == ClassSession.class_id,
+        Attendance.student_id == student_id,
+        Attendance.attendance_status == AttendanceStatus.present
+    )
+    rows = db.session.query(
+        Module.module_id,
+        Module.module_code,
+        Module.module_name,
+        func.count(func.distinct(ClassSession.class_id)).label('total_sessions'),
+        func.count(func.distinct(Attendance.class_id)).label('present_count')
+    ).select_from(Enrollment).join(
+        Module, Module.module_id == Enrollment.module_id
+    ).outerjoin(
+        ClassSession, ClassSession.module_id == Module.module_id
+    ).outerjoin(
+        Attendance, present
+    ).filter(
+        Enrollment.student_id == student_id
+    ).group_by(
+        Module.module_id, Module.module_code, Module.module_name
+    ).order_by(func.min(Enrollment.enrollment_id)).all()
+    
+    modules = [{
+        'module_code': row.module_code,
+        'module_name': row.module_name,
+        'total_sessions': row.total_sessions,
+        'present_count': row.present_count,
+        'attendance_percent': round((row.present_count / row.total_sessions * 100) if row.total_sessions > 0 else 0, 2)
+    } for row in rows]
+    
+    total_classes = sum(row.total_sessions for row in rows)
+    attended = sum(row.present_count for row in rows)
+    return {
+        'module_ids': frozenset(row.module_id for row in rows),
+        'modules': modules,
+        'total_classes': total_classes,
+        'total_classes_attended': attended,
+        'overall_attendance': round((attended / total_classes * 100) if total_classes > 0 else 0, 2)
+    }
+
 @app.route('/student/dashboard')
 @login_required
 def student_dashboard():
@@ -262,52 +388,13 @@ def student_dashboard():
         flash('Access denied. Student privileges required.', 'danger')
         return redirect(url_for('home'))
     
-    # Get enrolled modules for the student
-    enrolled_modules = Enrollment.query.filter_by(student_id=current_user.user_id).all()
-    modules_data = []
-    
-    for enrollment in enrolled_modules:
-        module = enrollment.module
-        # Get attendance stats for this module - ONLY classes for this module
-        classes = ClassSession.query.filter_by(module_id=module.module_id).all()
-        class_ids = [c.class_id for c in classes]
-        
-        total_sessions = len(class_ids)
-        present_count = Attendance.query.filter(
-            Attendance.student_id == current_user.user_id,
-            Attendance.class_id.in_(class_ids),
-            Attendance.attendance_status == AttendanceStatus.present
-        ).count()
-        
-        attendance_percent = round((present_count / total_sessions * 100) if total_sessions > 0 else 0, 2)
-        
-        modules_data.append({
-            'module_code': module.module_code,
-            'module_name': module.module_name,
-            'total_sessions': total_sessions,
-            'present_count': present_count,
-            'attendance_percent': attendance_percent
-        })
-    
-    # Get overall attendance stats - ONLY for enrolled modules
-    enrolled_module_ids = [em.module_id for em in enrolled_modules]
-    enrolled_classes = ClassSession.query.filter(ClassSession.module_id.in_(enrolled_module_ids)).all() if enrolled_module_ids else []
-    enrolled_class_ids = [c.class_id for c in enrolled_classes]
-    
-    all_classes_attended = Attendance.query.filter(
-        Attendance.student_id == current_user.user_id, 
-        Attendance.attendance_status == AttendanceStatus.present,
-        Attendance.class_id.in_(enrolled_class_ids) if enrolled_class_ids else False
-    ).count()
-    
-    all_classes_total = len(enrolled_class_ids)
-    overall_attendance = round((all_classes_attended / all_classes_total * 100) if all_classes_total > 0 else 0, 2)
+    summary = student_summaries.get(current_user.user_id, load_student_summary)
     
     return render_template('student_dashboard.html', 
-                          modules_data=modules_data,
-                          overall_attendance=overall_attendance,
-                          total_classes_attended=all_classes_attended,
-                          total_classes=all_classes_total)
+                          modules_data=summary['modules'],
+                          overall_attendance=summary['overall_attendance'],
+                          total_classes_attended=summary['total_classes_attended'],
+                          total_classes=summary['total_classes'])
 
 @app.route('/student/attendance')
 @login_required
@@ -442,6 +529,109 @@ def lecturer_view_attendance():
     return render_template('view_attendance.html', form=form, attendances=attendances)
 
 
+def compute_module_marks(module_ids, lecturer_id):
+    """Attendance marks for every enrolled student of each module, in one GROUP BY query
+    
+    Only classes taught by lecturer_id count as sessions. Returns a list of
+    {'module', 'total_sessions', 'students'} in module code order.
+    """
+    if not module_ids:
+        return []
+    
+    present = db.and_(
+        Attendance.class_id == ClassSession.class_id,
+        Attendance.student_id == Enrollment.student_id,
+        Attendance.attendance_status == AttendanceStatus.present
+    )
+    rows = db.session.query(
+        Enrollment.module_id,
+        User.student_number,
+        User.full_name,
+        func.count(func.distinct(ClassSession.class_id)).label('total_sessions'),
+        func.count(func.distinct(Attendance.class_id)).label('present_count')
+    ).join(
+        User, User.user_id == Enrollment.student_id
+    ).outerjoin(
+        ClassSession, db.and_(ClassSession.module_id == Enrollment.module_id, ClassSession.lecturer_id == lecturer_id)
+    ).outerjoin(
+        Attendance, present
+    ).filter(
+        Enrollment.module_id.in_(module_ids)
+    ).group_by(
+        Enrollment.module_id, User.user_id, User.student_number, User.full_name
+    ).order_by(Enrollment.module_id, func.min(Enrollment.enrollment_id)).all()
+    
+    modules = {m.module_id: m for m in Module.query.filter(Module.module_id.in_(module_ids)).all()}
+    marks = {module_id: {'module': module, 'total_sessions': 0, 'students': []} for module_id, module in modules.items()}
+    for row in rows:
+        entry = marks[row.module_id]
+        # Every student of a module sees the same classes, so any row carries the module's total
+        entry['total_sessions'] = row.total_sessions
+        percent = round((row.present_count / row.total_sessions * 100) if row.total_sessions > 0 else 0, 2)
+        entry['students'].append({
+            'student_number': row.student_number,
+            'name': row.full_name,
+            'present': row.present_count,
+            'percent': percent,
+            'warning': percent < 75
+        })
+    
+    # Modules nobody is enrolled in still report their session count
+    empty = [module_id for module_id, entry in marks.items() if not entry['students']]
+    if empty:
+        for module_id, total in db.session.query(ClassSession.module_id, func.count(ClassSession.class_id)).filter(
+            ClassSession.module_id.in_(empty), ClassSession.lecturer_id == lecturer_id
+        ).group_by(ClassSession.module_id).all():
+            marks[module_id]['total_sessions'] = total
+    
+    return sorted(marks.values(), key=lambda entry: entry['module'].module_code)
+
+def excel_sheet_names(names):
+    """Valid, unique Excel sheet names for names: at most 31 characters and none of []:*?/\\"""
+    used = set()
+    sheet_names = []
+    for name in names:
+        base = re.sub(r'[\[\]:*?/\\]', '_', name).strip("'")[:31] or 'Sheet'
+        sheet_name, n = base, 1
+        while sheet_name.lower() in used:
+            n += 1
+            suffix = f" ({n})"
+            sheet_name = base[:31 - len(suffix)] + suffix
+        used.add(sheet_name.lower())
+        sheet_names.append(sheet_name)
+    return sheet_names
+
+def export_marks(module_marks, file_format):
+    """Download the marks of one or more modules as a CSV or XLSX file (one sheet per module)"""
+    frames = {}
+    for entry in module_marks:
+        module = entry['module']
+        frame = pd.DataFrame(entry['students'], columns=['student_number', 'name', 'present', 'percent', 'warning'])
+        frame.insert(0, 'module_code', module.module_code)
+        frame.insert(3, 'total_sessions', entry['total_sessions'])
+        frames[module.module_code] = frame.rename(columns={
+            'module_code': 'Module', 'student_number': 'Student Number', 'name': 'Name', 'total_sessions': 'Total Sessions',
+            'present': 'Present', 'percent': 'Percentage', 'warning': 'Low Attendance'
+        })
+    
+    filename = f"attendance_marks_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    if file_format == 'xlsx':
+        output = io.BytesIO()
+        with pd.ExcelWriter(output) as writer:
+            for sheet_name, frame in zip(excel_sheet_names(frames), frames.values()):
+                frame.to_excel(writer, sheet_name=sheet_name, index=False)
+            if not frames:
+                pd.DataFrame().to_excel(writer, sheet_name='Marks', index=False)
+        response = make_response(output.getvalue())
+        response.headers["Content-Disposition"] = f"attachment; filename={filename}.xlsx"
+        response.headers["Content-type"] = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        return response
+    
+    response = make_response(pd.concat(frames.values(), ignore_index=True).to_csv(index=False) if frames else '')
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}.csv"
+    response.headers["Content-type"] = "text/csv"
+    return response
+
 @app.route('/lecturer/allocate_marks', methods=['GET', 'POST'])
 @login_required
 def lecturer_allocate_marks():
@@ -453,39 +643,18 @@ def lecturer_allocate_marks():
     assignments = Assignment.query.filter_by(lecturer_id=current_user.user_id).all()
     form.module_id.choices = [(a.module.module_id, f"{a.module.module_code} - {a.module.module_name}") for a in assignments]
     
-    students_data = []
-    module = None
-    total_sessions = 0
+    module_marks = []
     
     if form.validate_on_submit():
-        module_id = form.module_id.data
-        module = Module.query.get(module_id)
-        
-        # Get classes for this module taught by lecturer
-        classes = ClassSession.query.filter_by(module_id=module_id, lecturer_id=current_user.user_id).all()
-        total_sessions = len(classes)
-        class_ids = [c.class_id for c in classes]
+        module_ids = [module_id for module_id, _ in form.module_id.choices] if form.all_modules.data else [form.module_id.data]
+        module_marks = compute_module_marks(module_ids, current_user.user_id)
         
-        # Get enrolled students
-        enrollments = Enrollment.query.filter_by(module_id=module_id).all()
-        
-        for enrollment in enrollments:
-            student = enrollment.student
-            present_count = Attendance.query.filter(
-                Attendance.student_id == student.user_id,
-                Attendance.class_id.in_(class_ids),
-                Attendance.attendance_status == AttendanceStatus.present
-            ).count()
-            percent = round((present_count / total_sessions * 100) if total_sessions > 0 else 0, 2)
-            students_data.append({
-                'student_number': student.student_number,
-                'name': student.full_name,
-                'present': present_count,
-                'percent': percent,
-                'warning': percent < 75
-            })
+        if form.export_xlsx.data:
+            return export_marks(module_marks, 'xlsx')
+        if form.export_csv.data:
+            return export_marks(module_marks, 'csv')
     
-    return render_template('allocate_marks.html', form=form, module=module, total_sessions=total_sessions, students_data=students_data)
+    return render_template('allocate_marks.html', form=form, module_marks=module_marks)
 
 @app.route('/lecturer/calendar')
 @login_required
@@ -576,6 +745,42 @@ def is_session_active(class_session):
     
     return class_start_datetime <= current_time <= class_end_datetime
 
+def load_class_counters(class_sessions):
+    """Enrolled, facial data and attendance counts of several classes, in one query of grouped subqueries"""
+    module_ids = {class_session.module_id for class_session in class_sessions}
+    class_ids = [class_session.class_id for class_session in class_sessions]
+    
+    enrolled = db.session.query(
+        Enrollment.module_id, func.count(Enrollment.student_id).label('total')
+    ).filter(Enrollment.module_id.in_(module_ids)).group_by(Enrollment.module_id).subquery()
+    faces = db.session.query(
+        Enrollment.module_id, func.count(FacialData.facial_id).label('total')
+    ).join(
+        FacialData, FacialData.student_id == Enrollment.student_id
+    ).filter(Enrollment.module_id.in_(module_ids)).group_by(Enrollment.module_id).subquery()
+    marked = db.session.query(
+        Attendance.class_id, func.count(Attendance.attendance_id).label('total')
+    ).filter(Attendance.class_id.in_(class_ids)).group_by(Attendance.class_id).subquery()
+    
+    rows = db.session.query(
+        ClassSession.class_id,
+        func.coalesce(enrolled.c.total, 0).label('enrollment_count'),
+        func.coalesce(faces.c.total, 0).label('facial_data_count'),
+        func.coalesce(marked.c.total, 0).label('attendance_count')
+    ).outerjoin(
+        enrolled, enrolled.c.module_id == ClassSession.module_id
+    ).outerjoin(
+        faces, faces.c.module_id == ClassSession.module_id
+    ).outerjoin(
+        marked, marked.c.class_id == ClassSession.class_id
+    ).filter(ClassSession.class_id.in_(class_ids)).all()
+    
+    return {row.class_id: {
+        'enrollment_count': row.enrollment_count,
+        'facial_data_count': row.facial_data_count,
+        'attendance_count': row.attendance_count
+    } for row in rows}
+
 @app.route('/lecturer/attendance_scanner')
 @login_required
 def lecturer_attendance_scanner():
@@ -587,36 +792,24 @@ def lecturer_attendance_scanner():
     today = date.today()
     
     # Only show classes that haven't ended yet
-    todays_classes = ClassSession.query.filter_by(
+    todays_classes = ClassSession.query.options(joinedload(ClassSession.module)).filter_by(
         lecturer_id=current_user.user_id,
         class_date=today
     ).order_by(ClassSession.start_time).all()
     
     # Filter out classes that have ended
+    open_classes = [class_session for class_session in todays_classes if not is_session_ended(class_session)]
+    counters = class_counters.get_many(open_classes, load_class_counters)
+    
     active_classes = []
-    for class_session in todays_classes:
-        if not is_session_ended(class_session):
-            # Get enrollment count
-            enrollment_count = Enrollment.query.filter_by(module_id=class_session.module_id).count()
-            
-            # Get facial data count for enrolled students
-            enrollments = Enrollment.query.filter_by(module_id=class_session.module_id).all()
-            student_ids = [enrollment.student_id for enrollment in enrollments]
-            facial_data_count = FacialData.query.filter(FacialData.student_id.in_(student_ids)).count() if student_ids else 0
-            
-            # Get attendance count for this SPECIFIC class session
-            attendance_count = Attendance.query.filter_by(class_id=class_session.class_id).count()
-            
-            # Check if session is currently active
-            session_active = is_session_active(class_session)
-            
-            active_classes.append({
-                'class_session': class_session,
-                'enrollment_count': enrollment_count,
-                'facial_data_count': facial_data_count,
-                'attendance_count': attendance_count,
-                'session_active': session_active
-            })
+    for class_session in open_classes:
+        active_classes.append({
+            'class_session': class_session,
+            'enrollment_count': counters[class_session.class_id]['enrollment_count'],
+            'facial_data_count': counters[class_session.class_id]['facial_data_count'],
+            'attendance_count': counters[class_session.class_id]['attendance_count'],
+            'session_active': is_session_active(class_session)
+        })
     
     return render_template('attendance_scanner.html', classes_data=active_classes)
 
@@ -639,6 +832,10 @@ def browser_face_scan(class_id):
     # Check if session is currently active
     is_session_active_flag = is_session_active(class_session)
     
+    # Build the gallery while the lecturer starts the camera
+    if not is_session_ended_flag:
+        prewarm_galleries([class_session.module_id])
+    
     # Get current time for display
     now = datetime.now(timezone.utc).astimezone()
     
@@ -655,6 +852,7 @@ def browser_face_scan(class_id):
 @app.route('/lecturer/get_student_faces')
 @login_required
 def get_student_faces():
+    """Class roster with thumbnail URLs; the images themselves are fetched (and cached) separately"""
     if current_user.role != Role.lecturer:
         return jsonify({'success': False, 'message': 'Access denied'})
     
@@ -666,50 +864,27 @@ def get_student_faces():
     if not class_session or class_session.lecturer_id != current_user.user_id:
         return jsonify({'success': False, 'message': 'Class not found'})
     
-    # Get enrolled students with facial data
-    enrollments = Enrollment.query.filter_by(module_id=class_session.module_id).all()
-    students_data = []
+    # Enrolled students and their facial data in one query
+    rows = db.session.query(User, FacialData.thumbnail_path, FacialData.facial_id).join(
+        Enrollment, Enrollment.student_id == User.user_id
+    ).outerjoin(
+        FacialData, FacialData.student_id == User.user_id
+    ).filter(
+        Enrollment.module_id == class_session.module_id
+    ).order_by(User.full_name).all()
     
-    for enrollment in enrollments:
-        student = enrollment.student
-        facial_data = FacialData.query.filter_by(student_id=student.user_id).first()
-        
-        student_info = {
+    students_data = []
+    for student, thumbnail_path, facial_id in rows:
+        students_data.append({
             'user_id': student.user_id,
             'name': student.full_name,
             'student_number': student.student_number,
-            'has_face_data': facial_data is not None
-        }
-        
-        # Load face image data if available
-        if facial_data:
-            filepath = os.path.join(UPLOAD_FOLDER, facial_data.image_path)
-            if os.path.exists(filepath):
-                try:
-                    # Read and encode the image
-                    with open(filepath, "rb") as image_file:
-                        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                        student_info['faceData'] = f"data:image/jpeg;base64,{encoded_string}"
-                except Exception as e:
-                    print(f"Error loading face image: {e}")
-                    
-                # Try to read image data directly if previous open failed
-                try:
-                    with open(filepath, "rb") as image_file:
-                        image_data = image_file.read()
-                    if len(image_data) > 0:
-                        encoded_string = base64.b64encode(image_data).decode('utf-8')
-                        student_info['faceData'] = f"data:image/jpeg;base64,{encoded_string}"
-                    else:
-                        print(f"Empty image file for student {student.student_number}")
-                        student_info['has_face_data'] = False
-                except Exception as e2:
-                    print(f"Error loading face image for {student.student_number}: {e2}")
-                    student_info['has_face_data'] = False
-        
-        students_data.append(student_info)
+            'has_face_data': facial_id is not None,
+            'thumbnail_url': url_for('face_thumbnail', student_id=student.user_id, v=thumbnail_etag(thumbnail_path))
+                             if thumbnail_path else None
+        })
     
-    return jsonify({'success': True, 'students': students_data})
+    return compressed_json({'success': True, 'students': students_data})
 
 @app.route('/lecturer/mark_attendance_manual', methods=['POST'])
 @login_required
@@ -717,32 +892,31 @@ def mark_attendance_manual():
     if current_user.role != Role.lecturer:
         return jsonify({'success': False, 'message': 'Access denied'})
     
-    data = request.get_json()
-    student_id = data.get('student_id')
-    class_id = data.get('class_id')
+    data = request.get_json(silent=True) or {}
+    try:
+        student_id = int(data.get('student_id'))
+        class_id = int(data.get('class_id'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Student ID and class ID required'})
     status = data.get('status', 'present')
     
-    # Check if attendance already exists
-    existing_attendance = Attendance.query.filter_by(
-        student_id=student_id,
-        class_id=class_id
-    ).first()
-    
-    if existing_attendance:
-        existing_attendance.attendance_status = AttendanceStatus.present if status == 'present' else AttendanceStatus.absent
-        existing_attendance.timestamp = datetime.now(timezone.utc).astimezone()
-    else:
-        attendance = Attendance(
-            student_id=student_id,
-            class_id=class_id,
-            attendance_status=AttendanceStatus.present if status == 'present' else AttendanceStatus.absent,
-            timestamp=datetime.now(timezone.utc).astimezone()
-        )
-        db.session.add(attendance)
+    class_session = ClassSession.query.get(class_id)
+    if not class_session or class_session.lecturer_id != current_user.user_id:
+        return jsonify({'success': False, 'message': 'Class not found'})
     
+    student = User.query.get(student_id)
+    if not student or student.role != Role.student or not Enrollment.query.filter_by(
+            module_id=class_session.module_id, student_id=student_id).first():
+        return jsonify({'success': False, 'message': 'Student is not enrolled in this class'})
+    
+    # Insert the mark, or overwrite the student's existing one for this class
+    mark_attendance([(student_id, class_id)],
+                    AttendanceStatus.present if status == 'present' else AttendanceStatus.absent,
+                    overwrite=True)
     db.session.commit()
+    # Keep the scanner's already-present set in step with manual changes
+    record_presence(class_id, [student_id], status == 'present')
     
-    student = User.query.get(student_id)
     return jsonify({
         'success': True,
         'message': f'Attendance marked for {student.full_name}',
@@ -761,18 +935,214 @@ def recognize_face():
         data = request.get_json()
         image_data = data.get('image_data')
         class_id = data.get('class_id')
+        mode = data.get('mode', 'single')
+        confirm_marked = bool(data.get('confirm_marked', False))
         
         if not image_data or not class_id:
             return jsonify({'success': False, 'message': 'Missing image data or class ID'})
         
-        # Use the facial recognition function
-        result = recognize_face_from_image(image_data, class_id)
+        # Use the facial recognition function ('multi' marks every face in a group photo)
+        if mode == 'multi':
+            result = recognize_faces_from_image(image_data, class_id, confirm_marked)
+        else:
+            result = recognize_face_from_image(image_data, class_id, confirm_marked)
         return jsonify(result)
         
     except Exception as e:
         print(f"Error in recognize_face: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
 
+@app.route('/lecturer/recognize_face_frame', methods=['POST'])
+@login_required
+def recognize_face_frame():
+    """Recognize a raw JPEG frame sent as application/octet-stream or multipart (canvas.toBlob)"""
+    if current_user.role != Role.lecturer:
+        return jsonify({'success': False, 'message': 'Access denied'})
+    
+    try:
+        class_id = request.args.get('class_id', type=int) or request.form.get('class_id', type=int)
+        mode = request.args.get('mode') or request.form.get('mode', 'single')
+        confirm_marked = (request.args.get('confirm_marked') or request.form.get('confirm_marked')) in ('1', 'true')
+        
+        if 'frame' in request.files:
+            image_bytes = request.files['frame'].read()
+        else:
+            image_bytes = request.get_data(cache=False)
+        
+        if not image_bytes or not class_id:
+            return jsonify({'success': False, 'message': 'Missing image data or class ID'})
+        
+        if mode == 'multi':
+            result = recognize_faces_from_image(image_bytes, class_id, confirm_marked)
+        else:
+            result = recognize_face_from_image(image_bytes, class_id, confirm_marked)
+        return jsonify(result)
+        
+    except Exception as e:
+        print(f"Error in recognize_face_frame: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+@app.route('/lecturer/walk_in_recognize', methods=['POST'])
+@login_required
+def walk_in_recognize():
+    """Identify a face against all students and mark them in whichever of their classes is running"""
+    if current_user.role != Role.lecturer:
+        return jsonify({'success': False, 'message': 'Access denied'})
+    
+    try:
+        data = request.get_json()
+        image_data = data.get('image_data')
+        
+        if not image_data:
+            return jsonify({'success': False, 'message': 'Missing image data'})
+        
+        result = identify_walk_in(image_data, exact=bool(data.get('exact')))
+        return jsonify(result)
+        
+    except Exception as e:
+        print(f"Error in walk_in_recognize: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+@app.route('/lecturer/recognition_jobs', methods=['POST'])
+@login_required
+def submit_recognition_job():
+    """Queue a scan and return its job id straight away (202), or 429 with Retry-After when full
+    
+    Takes the same input as recognize_face (JSON data URL) or recognize_face_frame (raw JPEG).
+    """
+    if current_user.role != Role.lecturer:
+        return jsonify({'success': False, 'message': 'Access denied'})
+    
+    data = request.get_json(silent=True)
+    if data is not None:
+        image_data = data.get('image_data')
+        class_id = data.get('class_id')
+        mode = data.get('mode', 'single')
+        confirm_marked = bool(data.get('confirm_marked', False))
+    else:
+        class_id = request.args.get('class_id', type=int) or request.form.get('class_id', type=int)
+        mode = request.args.get('mode') or request.form.get('mode', 'single')
+        confirm_marked = (request.args.get('confirm_marked') or request.form.get('confirm_marked')) in ('1', 'true')
+        if 'frame' in request.files:
+            image_data = request.files['frame'].read()
+        else:
+            image_data = request.get_data(cache=False)
+    
+    if not image_data or not class_id:
+        return jsonify({'success': False, 'message': 'Missing image data or class ID'})
+    
+    recognize = recognize_faces_from_image if mode == 'multi' else recognize_face_from_image
+    try:
+        job = recognition_queue.submit(recognize, image_data, int(class_id), confirm_marked,
+                                       owner_id=current_user.user_id)
+    except JobQueueFull as e:
+        response = jsonify({'success': False, 'busy': True, 'message': 'Scanner is busy, please try again in a moment',
+                            'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    
+    response = jsonify({'success': True, 'job_id': job.job_id, 'status': job.status,
+                        'result_url': url_for('get_recognition_job', job_id=job.job_id)})
+    response.headers['Location'] = url_for('get_recognition_job', job_id=job.job_id)
+    return response, 202
+
+@app.route('/lecturer/recognition_jobs/<job_id>')
+@login_required
+def get_recognition_job(job_id):
+    """Status of a queued scan; ?wait=N long-polls up to N seconds (max 10) for the result"""
+    if current_user.role != Role.lecturer:
+        return jsonify({'success': False, 'message': 'Access denied'})
+    
+    wait = min(request.args.get('wait', 0, type=float), 10)
+    job = recognition_queue.get(job_id, wait)
+    if job is None or job.pop('owner_id') != current_user.user_id:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify(job)
+
+def get_scan_session(token):
+    """The scan session for token in this worker, rebinding it here if it was opened on another one"""
+    scan = scan_sessions.get(token)
+    if scan is None:
+        issued = scan_sessions.read_token(token)
+        if issued is None or issued[1] != current_user.user_id:
+            return None, {'success': False, 'message': 'Unknown scan session'}
+        return open_scan_session(issued[0], current_user.user_id, token)
+    if scan.lecturer_id != current_user.user_id:
+        return None, {'success': False, 'message': 'Unknown scan session'}
+    return scan, None
+
+@app.route('/lecturer/scan_session', methods=['POST'])
+@login_required
+def open_scan_session_route():
+    """Bind a continuous scanning session to a class; frames then use its token"""
+    if current_user.role != Role.lecturer:
+        return jsonify({'success': False, 'message': 'Access denied'})
+    
+    data = request.get_json(silent=True) or {}
+    class_id = data.get('class_id') or request.form.get('class_id')
+    if not class_id:
+        return jsonify({'success': False, 'message': 'Class ID required'})
+    
+    scan, error = open_scan_session(int(class_id), current_user.user_id)
+    if error:
+        return jsonify(error)
+    
+    return jsonify({
+        'success': True,
+        'token': scan.token,
+        'class_info': scan.class_info,
+        'frame_url': url_for('scan_session_frame', token=scan.token),
+        'close_url': url_for('close_scan_session', token=scan.token),
+        'roster': scan.roster_delta(get_present_students(scan.class_id)),
+        'next_interval_ms': Config.SCAN_MIN_INTERVAL_MS
+    })
+
+@app.route('/lecturer/scan_session/<token>/frame', methods=['POST'])
+@login_required
+def scan_session_frame(token):
+    """Recognize one raw JPEG frame on an open scan session, returning the roster changes and when to send the next"""
+    if current_user.role != Role.lecturer:
+        return jsonify({'success': False, 'message': 'Access denied'})
+    
+    try:
+        scan, error = get_scan_session(token)
+        if error:
+            return jsonify(error), 404
+        
+        image_bytes = request.get_data(cache=False)
+        if not image_bytes:
+            return jsonify({'success': False, 'message': 'Missing image data'})
+        
+        mode = request.args.get('mode', 'single')
+        confirm_marked = request.args.get('confirm_marked') in ('1', 'true')
+        
+        started = time.perf_counter()
+        if mode == 'multi':
+            result = recognize_faces_from_image(image_bytes, scan.class_id, confirm_marked, scan=scan)
+        else:
+            result = recognize_face_from_image(image_bytes, scan.class_id, confirm_marked, scan=scan)
+        scan.record_frame(time.perf_counter() - started)
+        
+        result['next_interval_ms'] = scan.next_interval(result)
+        # Marks made elsewhere (other scanners, manual changes) ride back on the next frame
+        result['roster'] = scan.roster_delta(get_present_students(scan.class_id))
+        return jsonify(result)
+        
+    except Exception as e:
+        print(f"Error in scan_session_frame: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+@app.route('/lecturer/scan_session/<token>/close', methods=['POST'])
+@login_required
+def close_scan_session(token):
+    if current_user.role != Role.lecturer:
+        return jsonify({'success': False, 'message': 'Access denied'})
+    
+    scan = scan_sessions.get(token)
+    if scan is not None and scan.lecturer_id == current_user.user_id:
+        scan_sessions.close(token)
+    return jsonify({'success': True})
+
 @app.route('/lecturer/get_enrolled_students')
 @login_required
 def get_enrolled_students():
@@ -961,7 +1331,11 @@ def admin_delete_user(user_id):
         return redirect(url_for('admin_list_users'))
     
     try:
+        face_blobs = []
         if user.role == Role.student:
+            face_blobs = [key for row in db.session.query(FacialData.image_path, FacialData.thumbnail_path).filter_by(
+                student_id=user_id
+            ).all() for key in row]
             FacialData.query.filter_by(student_id=user_id).delete()
             Attendance.query.filter_by(student_id=user_id).delete()
             Enrollment.query.filter_by(student_id=user_id).delete()
@@ -980,6 +1354,13 @@ def admin_delete_user(user_id):
         
         db.session.delete(user)
         db.session.commit()
+        release_face_blobs(face_blobs)
+        # Bulk deletes above skip the ORM events that keep galleries fresh
+        gallery_cache.invalidate_student(user_id)
+        student_summaries.invalidate_student(user_id)
+        unindex_face(user_id)
+        class_presence.invalidate()
+        class_counters.clear()
         flash('User deleted successfully!', 'success')
         
     except Exception as e:
@@ -1089,6 +1470,10 @@ def admin_delete_module(module_id):
         # 5. Finally delete the module
         db.session.delete(module)
         db.session.commit()
+        gallery_cache.invalidate(module_id)
+        student_summaries.invalidate_module(module_id)
+        class_presence.invalidate()
+        class_counters.invalidate_module(module_id)
         flash('Module deleted successfully!', 'success')
         
     except Exception as e:
@@ -1198,6 +1583,7 @@ def admin_delete_class(class_id):
         # Now delete the class
         db.session.delete(class_session)
         db.session.commit()
+        class_presence.invalidate(class_id)
         flash('Class deleted successfully!', 'success')
         
     except Exception as e:
@@ -1382,7 +1768,7 @@ def admin_unenroll_student(student_id, module_id):
                     Attendance.class_id.in_(class_ids)
                 ).delete()
             
-            # Delete the enrollment
+            # Delete the enrollment (its delete event also drops the student's cached summary and the module's scanner counters)
             db.session.delete(enrollment)
             db.session.commit()
             flash('Student unenrolled successfully!', 'success')
@@ -1793,6 +2179,91 @@ def admin_analytics():
     return render_template('admin_analytics.html', total_students=total_students, total_lecturers=total_lecturers,
                            total_classes=total_classes, avg_attendance=avg_attendance, trends=trends)
 
+@app.route('/admin/face_detector_stats')
+@login_required
+def admin_face_detector_stats():
+    """Cascade load counts and detection timings for this worker process"""
+    if current_user.role != Role.admin:
+        return jsonify({'error': 'Permission denied'}), 403
+    return jsonify(detector_stats())
+
+@app.route('/admin/import_faces', methods=['POST'])
+@login_required
+def admin_import_faces():
+    """Start a bulk face import from an uploaded zip or a zip/directory already in FACE_IMPORT_FOLDER
+    
+    Files are named <student_number>.jpg. Importing the same source again resumes
+    from its report, which is kept next to it in FACE_IMPORT_FOLDER.
+    """
+    if current_user.role != Role.admin:
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    import_folder = os.path.join(BASE_DIR, Config.FACE_IMPORT_FOLDER)
+    os.makedirs(import_folder, exist_ok=True)
+    
+    if 'archive' in request.files and request.files['archive'].filename:
+        archive = request.files['archive']
+        source = os.path.join(import_folder, secure_filename(archive.filename))
+        archive.save(source)
+    else:
+        source = os.path.realpath(os.path.join(import_folder, request.form.get('path', '')))
+        if os.path.commonpath([source, os.path.realpath(import_folder)]) != os.path.realpath(import_folder) \
+                or source == os.path.realpath(import_folder) or not os.path.exists(source):
+            return jsonify({'error': 'Import source not found in the import folder'}), 400
+    
+    state = face_imports.start(source, source.rstrip(os.sep) + '.report.jsonl',
+                               workers=request.form.get('workers', type=int),
+                               batch_size=request.form.get('batch_size', 100, type=int))
+    return jsonify(state), 202
+
+@app.route('/admin/import_faces/<import_id>')
+@login_required
+def admin_import_faces_status(import_id):
+    """Progress and per-status counts of a bulk face import (per-file detail is in its report)"""
+    if current_user.role != Role.admin:
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    state = face_imports.get(import_id)
+    if state is None:
+        return jsonify({'error': 'Import not found'}), 404
+    return jsonify(state)
+
+@app.route('/admin/recognition_queue_stats')
+@login_required
+def admin_recognition_queue_stats():
+    """Queue depth plus wait and service times of queued recognition jobs in this worker process"""
+    if current_user.role != Role.admin:
+        return jsonify({'error': 'Permission denied'}), 403
+    return jsonify(recognition_queue.stats())
+
+@app.after_request
+def add_recognition_timing(response):
+    """Stage breakdown of the scan this request ran, as Server-Timing, when the client asked for it"""
+    timings = g.get('recognition_timings')
+    if timings is not None and request.headers.get(Config.DEBUG_TIMING_HEADER):
+        response.headers['Server-Timing'] = timings.server_timing()
+    return response
+
+recognition_metrics.add_gauge('recognition_queue_depth', 'Recognition jobs waiting in the queue.',
+                              lambda: recognition_queue.stats()['depth'])
+recognition_metrics.add_gauge('recognition_queue_running', 'Recognition jobs being run.',
+                              lambda: recognition_queue.stats()['running'])
+recognition_metrics.add_gauge('recognition_queue_rejected', 'Recognition jobs refused with 429 since start.',
+                              lambda: recognition_queue.stats()['rejected'])
+recognition_metrics.add_gauge('face_detector_cascade_loads', 'Haar cascades parsed by the worker processes.',
+                              lambda: detector_stats()['cascade_loads'])
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text metrics summed over the worker processes: recognition stages, scan counters and queues"""
+    if Config.METRICS_TOKEN:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {Config.METRICS_TOKEN}"):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    elif not current_user.is_authenticated or current_user.role != Role.admin:
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    
+    return Response(recognition_metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/admin/lecturer_assignments/<int:lecturer_id>', methods=['GET'])
 @login_required
 def admin_lecturer_assignments(lecturer_id):
@@ -0,0 +1,132 @@
+# scan_sessions.py - continuous scanning sessions bound once to a class, with roster deltas per frame
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from itsdangerous import BadSignature, URLSafeSerializer
+from config import Config
+
+class ScanSession:
+    """An open scanner: the class it was bound to when it opened and the roster its browser last saw"""
+    def __init__(self, token, class_id, module_id, lecturer_id, class_info, ends_at):
+        self.token = token
+        self.class_id = class_id
+        self.module_id = module_id
+        self.lecturer_id = lecturer_id
+        self.class_info = class_info
+        self.ends_at = ends_at  # aware datetime after which no attendance can be marked
+        self.frames = 0
+        self.service_time = None  # moving average of seconds spent per frame
+        self.last_seen = time.monotonic()
+        self.closed = False
+        self._sent_present = None  # students the browser was last told are present, None before the first reply
+        self._lock = threading.Lock()
+
+    def ended_error(self):
+        """Same refusal load_scan_class gives once the class is over, or None"""
+        if datetime.now(timezone.utc).astimezone() > self.ends_at:
+            return {'success': False, 'ended': True,
+                    'message': f'Class session {self.class_info} has ended. Attendance cannot be marked.'}
+        return None
+
+    def record_frame(self, elapsed):
+        with self._lock:
+            self.frames += 1
+            self.last_seen = time.monotonic()
+            if self.service_time is None:
+                self.service_time = elapsed
+            else:
+                self.service_time = 0.7 * self.service_time + 0.3 * elapsed
+
+    def next_interval(self, result):
+        """Milliseconds the browser should wait before sending its next frame
+
+        Frames go out as fast as the server turns them around, backing off when
+        the recognition pool is saturated and idling once everyone is marked.
+        """
+        if result.get('all_marked') or result.get('ended'):
+            return Config.SCAN_MAX_INTERVAL_MS
+        interval = Config.SCAN_MIN_INTERVAL_MS
+        if self.service_time is not None:
+            interval = max(interval, int(self.service_time * 1000 * 1.2))
+        if result.get('busy'):
+            interval *= 4
+        return min(interval, Config.SCAN_MAX_INTERVAL_MS)
+
+    def roster_delta(self, present):
+        """Students marked or unmarked since the last reply, or the whole present set on the first one
+
+        Replies carry the delta instead of a pushed event stream, so an open
+        scanner holds no server thread between frames. A session rebound on
+        another worker starts over with the whole set.
+        """
+        present = set(present)
+        with self._lock:
+            sent, self._sent_present = self._sent_present, present
+        if sent is None:
+            return {'added': sorted(present), 'removed': [], 'full': True}
+        return {'added': sorted(present - sent), 'removed': sorted(sent - present), 'full': False}
+
+    def close(self):
+        self.closed = True
+
+class ScanSessionRegistry:
+    """Open scan sessions of this worker process, keyed by a signed token
+
+    The token carries the class and lecturer it was issued for, so a frame that
+    lands on another gunicorn worker can rebind there without a new handshake.
+    """
+    def __init__(self, ttl=30 * 60):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _serializer(self):
+        return URLSafeSerializer(Config.SECRET_KEY, salt='scan-session')
+
+    def issue_token(self, class_id, lecturer_id):
+        return self._serializer().dumps({'c': class_id, 'l': lecturer_id, 'n': secrets.token_hex(8)})
+
+    def read_token(self, token):
+        """(class_id, lecturer_id) the token was issued for, or None if it was tampered with"""
+        try:
+            payload = self._serializer().loads(token)
+        except BadSignature:
+            return None
+        return payload['c'], payload['l']
+
+    def bind(self, token, class_session, class_info, ends_at):
+        scan = ScanSession(token, class_session.class_id, class_session.module_id,
+                           class_session.lecturer_id, class_info, ends_at)
+        with self._lock:
+            self._expire()
+            self._sessions[token] = scan
+        return scan
+
+    def get(self, token):
+        with self._lock:
+            scan = self._sessions.get(token)
+        if scan is not None:
+            scan.last_seen = time.monotonic()
+        return scan
+
+    def close(self, token):
+        with self._lock:
+            scan = self._sessions.pop(token, None)
+        if scan is not None:
+            scan.close()
+        return scan
+
+    def _expire(self):
+        now = time.monotonic()
+        for token in [t for t, s in self._sessions.items() if now - s.last_seen > self.ttl]:
+            self._sessions.pop(token).close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open_sessions': len(self._sessions),
+                'frames': sum(s.frames for s in self._sessions.values())
+            }
+
+scan_sessions = ScanSessionRegistry(Config.SCAN_SESSION_TTL)
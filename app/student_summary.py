@@ -0,0 +1,94 @@
+# student_summary.py - cached per-student attendance summaries for the student dashboard
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from config import Config
+from app.models import Attendance, ClassSession, Enrollment
+
+class StudentSummaryCache:
+    """LRU cache of dashboard summaries keyed by student_id
+
+    An entry is dropped when the student's attendance or enrollments change, or
+    when a class session is added to, moved or removed from one of their
+    modules. The TTL picks up writes made by other worker processes.
+    """
+    def __init__(self, max_size=4096, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # student_id -> (loaded_at, summary)
+        self._lock = threading.Lock()
+
+    def get(self, student_id, loader):
+        """Summary for student_id, loading it with loader(student_id) if missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(student_id)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(student_id)
+                return entry[1]
+
+        summary = loader(student_id)
+        with self._lock:
+            self._entries[student_id] = (now, summary)
+            self._entries.move_to_end(student_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return summary
+
+    def invalidate_student(self, student_id):
+        with self._lock:
+            self._entries.pop(student_id, None)
+
+    def invalidate_module(self, module_id):
+        """Drop every cached summary that includes module_id"""
+        with self._lock:
+            for student_id in [s for s, (_, summary) in self._entries.items() if module_id in summary['module_ids']]:
+                del self._entries[student_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+student_summaries = StudentSummaryCache(Config.STUDENT_SUMMARY_CACHE_SIZE, Config.STUDENT_SUMMARY_CACHE_TTL)
+
+# Same after-commit pattern as the gallery cache; bulk query.delete() calls must invalidate explicitly
+def queue_summary_invalidation(session, key):
+    """Drop ('student', id) or ('module', id) from the cache once session commits"""
+    session.info.setdefault('summary_invalidations', set()).add(key)
+
+def _queue_invalidation(target, key):
+    session = object_session(target)
+    if session is not None:
+        queue_summary_invalidation(session, key)
+
+@event.listens_for(Attendance, 'after_insert')
+@event.listens_for(Attendance, 'after_update')
+@event.listens_for(Attendance, 'after_delete')
+@event.listens_for(Enrollment, 'after_insert')
+@event.listens_for(Enrollment, 'after_update')
+@event.listens_for(Enrollment, 'after_delete')
+def _student_rows_changed(mapper, connection, target):
+    _queue_invalidation(target, ('student', target.student_id))
+
+@event.listens_for(ClassSession, 'after_insert')
+@event.listens_for(ClassSession, 'after_update')
+@event.listens_for(ClassSession, 'after_delete')
+def _class_session_changed(mapper, connection, target):
+    _queue_invalidation(target, ('module', target.module_id))
+    # A class moved to another module also changes the module it left
+    for module_id in inspect(target).attrs.module_id.history.deleted:
+        _queue_invalidation(target, ('module', module_id))
+
+@event.listens_for(Session, 'after_commit')
+def _apply_invalidations(session):
+    for kind, key in session.info.pop('summary_invalidations', ()):
+        if kind == 'module':
+            student_summaries.invalidate_module(key)
+        else:
+            student_summaries.invalidate_student(key)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidations(session):
+    session.info.pop('summary_invalidations', None)
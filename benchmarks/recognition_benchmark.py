@@ -0,0 +1,425 @@
+# recognition_benchmark.py - offline latency/throughput/memory benchmark of the face recognition hot path
+"""Benchmark face recognition against synthetic galleries in a throwaway SQLite database
+
+    python benchmarks/recognition_benchmark.py --sizes 50,500,5000
+    python benchmarks/recognition_benchmark.py --sizes 50000 --backend pca
+    python benchmarks/recognition_benchmark.py --compare benchmarks/results/recognition-<commit>.json
+
+Synthetic faces are drawn with OpenCV from random per-student parameters
+(skin tone, face shape, eyes, brows, nose, mouth), so the real Haar cascade
+finds them and every stage runs for real. For each gallery size one module
+is enrolled with that many students. Probe students are enrolled through
+ingest_face_image like an upload; the rest get embeddings of a directly
+rendered crop. Probe frames are 640x480 JPEGs of a probe student with
+jitter and noise.
+
+Targets:
+  single      recognize_face_from_image (scores everyone: confirm_marked=True)
+  group       recognize_faces_from_image on a frame with four faces
+  match_frame the CPU stages alone (decode, detect, embed, match)
+  walk_in     identify_walk_in against the campus-wide index (--backend pca only)
+
+Results (end-to-end and per-stage latency percentiles, throughput, peak
+Python/numpy memory, gallery build time and size, match accuracy) are
+written as JSON. --compare exits with status 1 when any p95 regressed by
+more than --threshold against an earlier result file.
+
+The recognition pool is disabled (spawned workers would not see the
+SQLite override) and images live in the in-memory face store. With
+--backend pca raw embeddings are not stored for the filler students, so a
+50,000-student gallery fits in memory; 'raw' at that size needs ~2 GB.
+"""
+import argparse
+import base64
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, time as dt_time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import Config
+
+TARGETS = ('single', 'group', 'match_frame', 'walk_in')
+FRAME_SIZE = (640, 480)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='50,500,5000', help='Comma-separated gallery sizes (students per module).')
+    parser.add_argument('--targets', default=','.join(TARGETS), help=f'Comma-separated subset of {",".join(TARGETS)}.')
+    parser.add_argument('--frames', type=int, default=40, help='Timed frames per target and size.')
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed frames before each target.')
+    parser.add_argument('--probes', type=int, default=40, help='Students enrolled through the upload path and used as probes.')
+    parser.add_argument('--backend', default='raw', choices=['raw', 'pca', 'lbph'], help='RECOGNIZER_BACKEND to benchmark.')
+    parser.add_argument('--data-url', action='store_true', help='Send frames as base64 data URLs instead of raw JPEG bytes.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic faces and frames.')
+    parser.add_argument('--output', default=None, help='Result JSON (default: benchmarks/results/recognition-<commit>.json).')
+    parser.add_argument('--compare', default=None, help='Earlier result JSON to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p95 slowdown (fraction) that counts as a regression.')
+    return parser.parse_args(argv)
+
+def configure(args, workdir):
+    """Point the app at a throwaway SQLite database and model folder before it is imported"""
+    Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    Config.FACE_MODEL_FOLDER = os.path.join(workdir, 'face_models')
+    Config.METRICS_FOLDER = os.path.join(workdir, 'metrics')
+    Config.FACE_STORAGE_BACKEND = 'memory'
+    Config.RECOGNITION_POOL_SIZE = 0
+    Config.RECOGNIZER_BACKEND = args.backend
+    Config.GALLERY_CACHE_TTL = 24 * 3600
+
+# Synthetic faces
+
+def face_params(rng):
+    return {
+        'skin': int(rng.integers(140, 225)),
+        'width': rng.uniform(0.28, 0.36),
+        'height': rng.uniform(0.38, 0.46),
+        'eye_gap': rng.uniform(0.10, 0.16),
+        'eye_w': rng.uniform(0.05, 0.08),
+        'eye_h': rng.uniform(0.025, 0.045),
+        'eye_y': rng.uniform(0.08, 0.13),
+        'brow': int(rng.integers(2, 6)),
+        'nose': rng.uniform(0.08, 0.14),
+        'mouth_w': rng.uniform(0.08, 0.14),
+        'mouth_y': rng.uniform(0.19, 0.25),
+        'background': int(rng.integers(40, 120)),
+    }
+
+def draw_face(image, params, cx, cy, size, rng=None):
+    """Draw a frontal face of the given identity centred on (cx, cy), size pixels tall-ish"""
+    jitter = (lambda scale: rng.uniform(-scale, scale)) if rng is not None else (lambda scale: 0.0)
+    p = params
+    skin = int(np.clip(p['skin'] + jitter(12), 0, 255))
+    cv2.ellipse(image, (cx, cy), (int(size * p['width']), int(size * p['height'])), 0, 0, 360, (skin,) * 3, -1)
+    eye_y = cy - int(size * p['eye_y'])
+    eye_gap = int(size * p['eye_gap'])
+    for side in (-1, 1):
+        ex = cx + side * eye_gap + int(jitter(2))
+        cv2.ellipse(image, (ex, eye_y), (int(size * p['eye_w']), int(size * p['eye_h'])), 0, 0, 360, (40, 40, 40), -1)
+        brow_y = eye_y - int(size * 0.09)
+        cv2.line(image, (ex - int(size * 0.075), brow_y), (ex + int(size * 0.075), brow_y), (50, 50, 50), p['brow'])
+    cv2.line(image, (cx, eye_y + int(size * 0.05)), (cx, cy + int(size * p['nose'])), (max(skin - 50, 0),) * 3, 3)
+    cv2.ellipse(image, (cx, cy + int(size * p['mouth_y'])), (int(size * p['mouth_w']), int(size * 0.03)),
+                0, 0, 360, (60, 60, 90), -1)
+
+def render_crop(params, size=100):
+    """A tight face crop, the same framing the gallery embeds"""
+    image = np.full((size, size, 3), params['background'], np.uint8)
+    draw_face(image, params, size // 2, size // 2, size)
+    return cv2.GaussianBlur(image, (3, 3), 0)
+
+def render_frame(faces, rng):
+    """A scanner-sized frame with each identity in faces drawn at a jittered position"""
+    width, height = FRAME_SIZE
+    image = np.full((height, width, 3), int(rng.integers(60, 110)), np.uint8)
+    cols = 2 if len(faces) > 1 else 1
+    rows = (len(faces) + cols - 1) // cols
+    cell_w, cell_h = width // cols, height // rows
+    for i, params in enumerate(faces):
+        size = int(min(cell_w, cell_h) * rng.uniform(0.7, 0.85))
+        cx = (i % cols) * cell_w + cell_w // 2 + int(rng.integers(-10, 11))
+        cy = (i // cols) * cell_h + cell_h // 2 + int(rng.integers(-10, 11))
+        draw_face(image, params, cx, cy, size, rng)
+    image = cv2.GaussianBlur(image, (5, 5), 0)
+    noise = rng.normal(0, 4, image.shape)
+    image = np.clip(image.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return encoded.tobytes()
+
+def as_payload(jpeg, data_url):
+    if data_url:
+        return 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode('ascii')
+    return jpeg
+
+# Gallery seeding
+
+def seed_gallery(size, args, rng):
+    """Create one module with size enrolled students and a class running now
+
+    Returns (class_id, module_id, probes) where probes is [(student_id, face params)].
+    """
+    db.drop_all()
+    db.create_all()
+    gallery_cache.clear()
+    class_presence.invalidate()
+    for path in glob.glob(os.path.join(Config.FACE_MODEL_FOLDER, '*.npz')):
+        os.remove(path)
+    reset_active_projection()
+
+    lecturer = User(full_name='Benchmark Lecturer', username='bench_lecturer', role=Role.lecturer)
+    module = Module(module_code='BENCH101', module_name='Benchmark Module')
+    db.session.add_all([lecturer, module])
+    db.session.flush()
+    class_session = ClassSession(module_id=module.module_id, lecturer_id=lecturer.user_id, class_type=ClassType.lecture,
+                                 class_date=date.today(), start_time=dt_time(0, 0), end_time=dt_time(23, 59, 59))
+    db.session.add(class_session)
+
+    db.session.execute(db.insert(User), [
+        {'full_name': f'Student {i}', 'student_number': f'9{i:07d}', 'role': Role.student} for i in range(size)
+    ])
+    student_ids = [row.user_id for row in db.session.query(User.user_id).filter(User.role == Role.student)
+                   .order_by(User.user_id)]
+    db.session.execute(db.insert(Enrollment), [
+        {'student_id': student_id, 'module_id': module.module_id, 'enrollment_date': date.today()}
+        for student_id in student_ids
+    ])
+
+    identities = [face_params(rng) for _ in range(size)]
+    n_probes = min(args.probes, size)
+    now = datetime.now()
+
+    # Probes go through the upload path, fillers are embedded straight from a rendered crop
+    probe_embeddings = {}
+    for i in range(n_probes):
+        face_jpeg, embedding, error = ingest_face_image(render_frame([identities[i]], rng))
+        if error:
+            raise RuntimeError(f"Synthetic probe face {i} was rejected: {error}")
+        probe_embeddings[i] = embedding
+
+    def embedding_of(i):
+        if i in probe_embeddings:
+            return probe_embeddings[i]
+        gray = cv2.cvtColor(render_crop(identities[i]), cv2.COLOR_BGR2GRAY)
+        return _face_embedding(gray, (0, 0, gray.shape[1], gray.shape[0]))
+
+    projection = None
+    if args.backend == 'pca':
+        sample = np.vstack([embedding_of(i) for i in range(min(size, 2000))])
+        # A new version per size, or the cached active projection would be kept
+        projection = fit_projection(sample, n_components=Config.FACE_PROJECTION_COMPONENTS,
+                                    dtype=Config.FACE_PROJECTION_DTYPE, version=size)
+        projection.save(Config.FACE_MODEL_FOLDER)
+        reset_active_projection()
+
+    for start in range(0, size, 1000):
+        rows = []
+        for i in range(start, min(start + 1000, size)):
+            embedding = embedding_of(i)
+            row = {'student_id': student_ids[i], 'image_path': f'bench/{i}.jpg', 'uploaded_at': now}
+            if projection is None or i in probe_embeddings:
+                row.update(embedding=serialize_embedding(embedding), embedding_version=EMBEDDING_VERSION)
+            if projection is not None:
+                row.update(projected_embedding=projection.serialize(projection.project(embedding)),
+                           projection_version=projection.version)
+            rows.append(row)
+        db.session.execute(db.insert(FacialData), rows)
+    db.session.commit()
+
+    return class_session.class_id, module.module_id, [(student_ids[i], identities[i]) for i in range(n_probes)]
+
+# Measurement
+
+def percentiles(values_ms):
+    values = np.asarray(values_ms, dtype=np.float64)
+    if values.size == 0:
+        return {}
+    return {'mean': round(float(values.mean()), 3), 'p50': round(float(np.percentile(values, 50)), 3),
+            'p95': round(float(np.percentile(values, 95)), 3), 'p99': round(float(np.percentile(values, 99)), 3),
+            'max': round(float(values.max()), 3)}
+
+def make_runner(target, class_id, module_id, probes, args, rng):
+    """Return (frames, run(payload) -> (student_ids_found, stage_durations))"""
+    if target == 'group':
+        groups = [[probes[(i + k) % len(probes)] for k in range(4)] for i in range(args.frames + args.warmup)]
+        frames = [([sid for sid, _ in group], render_frame([params for _, params in group], rng)) for group in groups]
+    else:
+        picks = [probes[i % len(probes)] for i in range(args.frames + args.warmup)]
+        frames = [([sid], render_frame([params], rng)) for sid, params in picks]
+    frames = [(expected, as_payload(jpeg, args.data_url)) for expected, jpeg in frames]
+
+    def in_request(func):
+        with app.test_request_context(), contextlib.redirect_stdout(io.StringIO()):
+            result = func()
+            timings = g.get('recognition_timings')
+            return result, (timings.durations if timings is not None else {})
+
+    if target == 'single':
+        def run(payload):
+            result, stages = in_request(lambda: recognize_face_from_image(payload, class_id, confirm_marked=True))
+            return [result['student_id']] if result.get('student_id') else [], stages
+    elif target == 'group':
+        def run(payload):
+            result, stages = in_request(lambda: recognize_faces_from_image(payload, class_id, confirm_marked=True))
+            return [face['student_id'] for face in result.get('faces', []) if face.get('student_id')], stages
+    elif target == 'match_frame':
+        def run(payload):
+            result = match_frame(payload, module_id)
+            return ([result['student_id']] if result.get('student_id') else []), result.get('timings', {})
+    else:
+        def run(payload):
+            result, stages = in_request(lambda: identify_walk_in(payload))
+            student = User.query.filter_by(student_number=result.get('student_number')).first() \
+                if result.get('student_number') else None
+            return ([student.user_id] if student else []), stages
+    return frames, run
+
+def bench_target(target, class_id, module_id, probes, args, rng):
+    frames, run = make_runner(target, class_id, module_id, probes, args, rng)
+    for _, payload in frames[:args.warmup]:
+        run(payload)
+
+    latencies, stages, correct, expected_total = [], {}, 0, 0
+    started = time.perf_counter()
+    for expected, payload in frames[args.warmup:]:
+        frame_started = time.perf_counter()
+        found, durations = run(payload)
+        latencies.append((time.perf_counter() - frame_started) * 1000)
+        for stage, seconds in durations.items():
+            stages.setdefault(stage, []).append(seconds * 1000)
+        correct += len(set(found) & set(expected))
+        expected_total += len(expected)
+    elapsed = time.perf_counter() - started
+
+    # Memory is measured on a separate short pass: tracemalloc slows every allocation down
+    tracemalloc.start()
+    for _, payload in frames[args.warmup:args.warmup + 5]:
+        run(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'target': target,
+        'frames': len(latencies),
+        'latency_ms': percentiles(latencies),
+        'throughput_fps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'stages_ms': {stage: percentiles(values) for stage, values in sorted(stages.items())},
+        'peak_memory_mb': round(peak / 1024 ** 2, 2),
+        'accuracy': round(correct / expected_total, 3) if expected_total else None,
+    }
+
+def bench_size(size, targets, args):
+    rng = np.random.default_rng(args.seed + size)
+    started = time.perf_counter()
+    class_id, module_id, probes = seed_gallery(size, args, rng)
+    seed_seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    gallery = get_module_gallery(module_id)
+    build_seconds = time.perf_counter() - started
+    _, build_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"Gallery of {size}: seeded in {seed_seconds:.1f}s, built in {build_seconds:.2f}s "
+          f"({gallery.nbytes / 1024 ** 2:.1f} MB, backend {gallery.key[0]})")
+    results = []
+    for target in targets:
+        if target == 'walk_in':
+            # The campus-wide index is built over projected embeddings only
+            if gallery.key[0] != 'pca':
+                print(f"  {'walk_in':<12} skipped: needs --backend pca")
+                continue
+            build_face_index()
+        result = bench_target(target, class_id, module_id, probes, args, rng)
+        result.update(size=size, gallery_build_s=round(build_seconds, 3),
+                      gallery_build_peak_mb=round(build_peak / 1024 ** 2, 2),
+                      gallery_mb=round(gallery.nbytes / 1024 ** 2, 2), seed_s=round(seed_seconds, 2))
+        latency = result['latency_ms']
+        print(f"  {target:<12} p50 {latency['p50']:8.2f} ms  p95 {latency['p95']:8.2f} ms  "
+              f"{result['throughput_fps']:7.1f} fps  peak {result['peak_memory_mb']:7.1f} MB  "
+              f"accuracy {result['accuracy']}")
+        results.append(result)
+    return results
+
+# Results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(results, baseline_path, threshold):
+    """Print p50/p95 changes against an earlier run; returns the (size, target) pairs whose p95 regressed"""
+    with open(baseline_path) as f:
+        baseline = {(r['size'], r['target']): r for r in json.load(f)['results']}
+
+    regressions = []
+    print(f"\nAgainst {baseline_path}:")
+    for result in results:
+        before = baseline.get((result['size'], result['target']))
+        if before is None:
+            continue
+        changes = []
+        for key in ('p50', 'p95'):
+            old, new = before['latency_ms'][key], result['latency_ms'][key]
+            changes.append(f"{key} {old:8.2f} -> {new:8.2f} ms ({(new - old) / old * 100 if old else 0:+6.1f}%)")
+        old_p95, new_p95 = before['latency_ms']['p95'], result['latency_ms']['p95']
+        regressed = old_p95 and (new_p95 - old_p95) / old_p95 > threshold
+        if regressed:
+            regressions.append((result['size'], result['target']))
+        print(f"  {result['size']:>6} {result['target']:<12} {'  '.join(changes)}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    targets = [t for t in args.targets.split(',') if t]
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        raise SystemExit(f"Unknown targets: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory(prefix='recognition-bench-') as workdir:
+        configure(args, workdir)
+        load_app()
+        with app.app_context():
+            results = [result for size in sizes for result in bench_size(size, targets, args)]
+            db.session.remove()
+
+    commit = git_commit()
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f'recognition-{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    report = {
+        'meta': {
+            'commit': commit,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'backend': args.backend, 'frames': args.frames, 'warmup': args.warmup, 'probes': args.probes,
+            'data_url': args.data_url, 'seed': args.seed,
+            'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count(),
+        },
+        'results': results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} p95 regression(s) over {args.threshold:.0%}")
+            return 1
+    return 0
+
+def load_app():
+    """Import the app once configure() has run; the app reads Config when it is first imported"""
+    global app, db, g
+    global User, Role, Module, ClassSession, ClassType, Enrollment, FacialData
+    global gallery_cache, class_presence, fit_projection, reset_active_projection
+    global EMBEDDING_VERSION, _face_embedding, build_face_index, get_module_gallery, identify_walk_in, ingest_face_image
+    global match_frame, recognize_face_from_image, recognize_faces_from_image, serialize_embedding
+    from flask import g
+    from app import app, db
+    from app.models import ClassSession, ClassType, Enrollment, FacialData, Module, Role, User
+    from app.face_gallery import class_presence, gallery_cache
+    from app.face_projection import fit_projection, reset_active_projection
+    from app.facial_recognition import (EMBEDDING_VERSION, _face_embedding, build_face_index, get_module_gallery, identify_walk_in,
+                                        ingest_face_image, match_frame, recognize_face_from_image,
+                                        recognize_faces_from_image, serialize_embedding)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,5 +16,52 @@ class Config:
 
     # Facial data upload settings
     UPLOAD_FOLDER = 'facial_data'
+    FACE_STORAGE_BACKEND = 'local'  # 'local' (content-addressed files under UPLOAD_FOLDER) or 'memory'
+    FACE_STORAGE_SHARD_DEPTH = 2  # two-hex-digit directory levels above each blob
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
\ No newline at end of file
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+
+    # Face image ingest (uploads are decoded in memory and only the face crop is stored)
+    FACE_INGEST_MAX_SIDE = 640  # uploads are shrunk to this before detection (the scanner's frame size)
+    FACE_IMAGE_MAX_SIDE = 400  # longest side of the stored face crop
+    FACE_CROP_MARGIN = 0.25  # margin kept around the detected face, as a fraction of its size
+    FACE_JPEG_QUALITY = 90
+    FACE_THUMBNAIL_SIZE = 96  # square roster thumbnails generated at upload time
+    FACE_IMAGE_CACHE_BYTES = 32 * 1024 * 1024  # in-process cache of hot face images per worker, 0 = off
+    COMPRESS_JSON_RESPONSES = True  # gzip large JSON bodies (e.g. class rosters) when the browser accepts it
+    FACE_IMPORT_FOLDER = 'face_imports'  # zips/directories admins can bulk import from, plus their reports
+
+    # Face recognition settings
+    FACE_MODEL_FOLDER = 'face_models'  # fitted PCA projections (face_projection_v<N>.npz)
+    FACE_PROJECTION_COMPONENTS = 128  # dimensions kept by 'flask fit-face-projection'
+    FACE_PROJECTION_DTYPE = 'float16'  # storage type of projected embeddings
+    RECOGNIZER_BACKEND = 'pca'  # 'raw', 'pca' (falls back to raw until fitted) or 'lbph' (needs opencv-contrib)
+    GALLERY_CACHE_SIZE = 64  # max module galleries kept in memory per worker
+    GALLERY_CACHE_TTL = 15 * 60  # seconds before a cached gallery is rebuilt regardless of changes
+    GALLERY_STAMP_INTERVAL = 5  # seconds between checks for other workers' enrollment and face changes
+    PRESENCE_CACHE_TTL = 10  # seconds before a class's already-present set is reloaded (bounds other workers' marks)
+    FACE_INDEX_LISTS = 0  # campus-wide index partitions, 0 = sqrt(number of faces)
+    FACE_INDEX_PROBES = 8  # partitions searched per walk-in query
+    FACE_INDEX_SYNC_INTERVAL = 5  # seconds between checks for faces other workers stored or deleted
+
+    # Recognition process pool (decode, detection and matching run outside the web worker)
+    RECOGNITION_POOL_SIZE = 2  # processes per web worker, 0 = run in the request
+    RECOGNITION_QUEUE_DEPTH = 16  # jobs allowed in flight before scans are refused
+    RECOGNITION_JOB_TIMEOUT = 10  # seconds to wait for a recognition job
+    RECOGNITION_JOB_WORKERS = 4  # threads per web worker running queued recognition jobs
+    RECOGNITION_JOB_QUEUE = 64  # queued jobs accepted before 429 Too Many Requests
+    RECOGNITION_JOB_RESULT_TTL = 120  # seconds a finished job result can be fetched
+    RECOGNITION_JOB_FOLDER = 'recognition_jobs'  # job status files shared by the web workers on this host
+    METRICS_TOKEN = None  # bearer token Prometheus sends to /metrics, None = logged-in admins only
+    METRICS_FOLDER = 'metrics'  # per-process metric snapshots that /metrics adds up across workers
+    DEBUG_TIMING_HEADER = 'X-Debug-Timing'  # request header asking for a Server-Timing stage breakdown
+
+    # Continuous scanning sessions (frames pushed by the browser, roster changes returned with each reply)
+    SCAN_SESSION_TTL = 30 * 60  # seconds an idle session stays bound
+    SCAN_MIN_INTERVAL_MS = 250  # fastest frame rate the browser is told to use
+    SCAN_MAX_INTERVAL_MS = 3000  # idle rate once everyone is marked
+
+    # Dashboards
+    STUDENT_SUMMARY_CACHE_SIZE = 4096  # student dashboard summaries kept per worker
+    STUDENT_SUMMARY_CACHE_TTL = 5 * 60  # seconds before a summary is reloaded (covers other workers' writes)
+    CLASS_COUNTER_CACHE_TTL = 60  # seconds before the scanner page's per-class counts are reloaded
\ No newline at end of file
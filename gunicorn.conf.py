@@ -0,0 +1,18 @@
+# gunicorn.conf.py - production server settings (see Procfile)
+# Sized for the 08:00 peak of about 30 lecturers scanning at once. Each scanner keeps
+# one short frame request in flight and nothing open between frames, so 4 x 12 threads
+# leave room for page loads. Recognition runs in each worker's process pool
+# (RECOGNITION_POOL_SIZE), so the threads mostly wait on it rather than use the CPU.
+# State a later request may read on another worker is shared: recognition job and
+# import status as files (RECOGNITION_JOB_FOLDER, FACE_IMPORT_FOLDER), metrics as
+# per-process snapshots summed by /metrics (METRICS_FOLDER), and the galleries and
+# walk-in index re-check database stamps (GALLERY_STAMP_INTERVAL, FACE_INDEX_SYNC_INTERVAL).
+worker_class = 'gthread'
+workers = 4
+threads = 12
+
+def post_worker_init(worker):
+    """Pre-build the face galleries for today's classes and the walk-in index as soon as a worker has loaded the app"""
+    from app.facial_recognition import prewarm_galleries, schedule_face_index_build
+    prewarm_galleries()
+    schedule_face_index_build()
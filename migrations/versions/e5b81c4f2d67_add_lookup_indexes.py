@@ -0,0 +1,80 @@
+"""Add lookup indexes and unique attendance/enrollment pairs
+
+Revision ID: e5b81c4f2d67
+Revises: c3d95f1e7a24
+Create Date: 2026-10-16 23:05:12.804116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b81c4f2d67'
+down_revision = 'c3d95f1e7a24'
+branch_labels = None
+depends_on = None
+
+
+def delete_duplicates(table, id_column, pair, keep_first):
+    """Delete all but one row of each duplicated pair, keeping the first row of keep_first's ordering"""
+    bind = op.get_bind()
+    columns = ', '.join(pair)
+    duplicates = bind.execute(sa.text(
+        f"SELECT {columns} FROM {table} GROUP BY {columns} HAVING COUNT(*) > 1"
+    )).fetchall()
+
+    doomed = []
+    for values in duplicates:
+        match = ' AND '.join(f"{column} = :{column}" for column in pair)
+        ids = [row[0] for row in bind.execute(sa.text(
+            f"SELECT {id_column} FROM {table} WHERE {match} ORDER BY {keep_first}"
+        ), dict(zip(pair, values))).fetchall()]
+        doomed.extend(ids[1:])
+
+    for start in range(0, len(doomed), 500):
+        bind.execute(sa.text(f"DELETE FROM {table} WHERE {id_column} IN :ids").bindparams(
+            sa.bindparam('ids', expanding=True)
+        ), {'ids': doomed[start:start + 500]})
+    if doomed:
+        print(f"Removed {len(doomed)} duplicate row(s) from {table}.")
+
+
+def upgrade():
+    # Concurrent scans could insert the same mark twice; a present row wins, then the oldest
+    delete_duplicates('attendance', 'attendance_id', ('class_id', 'student_id'),
+                      "CASE WHEN attendance_status = 'present' THEN 0 ELSE 1 END, attendance_id")
+    delete_duplicates('enrollments', 'enrollment_id', ('module_id', 'student_id'), 'enrollment_id')
+
+    # The unique constraints double as the (class_id, student_id) and (module_id, student_id) indexes
+    with op.batch_alter_table('attendance', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_attendance_class_student', ['class_id', 'student_id'])
+
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_enrollments_module_student', ['module_id', 'student_id'])
+
+    with op.batch_alter_table('facial_data', schema=None) as batch_op:
+        batch_op.create_index('ix_facial_data_student_id', ['student_id'], unique=False)
+
+    with op.batch_alter_table('classes', schema=None) as batch_op:
+        batch_op.create_index('ix_classes_lecturer_date', ['lecturer_id', 'class_date'], unique=False)
+
+
+def downgrade():
+    # MySQL may have dropped its own foreign key indexes in favour of these, so give the keys one back first
+    if op.get_bind().dialect.name == 'mysql':
+        op.create_index('ix_classes_lecturer_id', 'classes', ['lecturer_id'], unique=False)
+        op.create_index('ix_enrollments_module_id', 'enrollments', ['module_id'], unique=False)
+        op.create_index('ix_attendance_class_id', 'attendance', ['class_id'], unique=False)
+
+    with op.batch_alter_table('classes', schema=None) as batch_op:
+        batch_op.drop_index('ix_classes_lecturer_date')
+
+    with op.batch_alter_table('facial_data', schema=None) as batch_op:
+        batch_op.drop_index('ix_facial_data_student_id')
+
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_enrollments_module_student', type_='unique')
+
+    with op.batch_alter_table('attendance', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_attendance_class_student', type_='unique')